@@ -1,10 +1,17 @@
 #!/usr/bin/env python3
 
+import re
 import sys
+import logging
 import time
+import threading
 import requests
 import os
-from bs4 import BeautifulSoup
+import orjson
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
+from bs4 import BeautifulSoup, SoupStrainer
 from urllib.parse import urlencode, urljoin
 
 from result_processor import ResultProcessor, OUTPUT_DIR_NAME, SYN_FILE
@@ -15,88 +22,210 @@ HEADERS = {
     'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64; rv:128.0) Gecko/20100101 Firefox/128.0'
 }
 WAIT = 5 # segundos entre búsquedas
+CONCURRENCY = int(os.getenv("AHMIA_CONCURRENCY", "8")) # búsquedas simultáneas
+MAX_RETRIES = 3 # reintentos ante errores de red, 429 y 5xx
+BACKOFF_BASE = 2 # segundos, se duplica en cada reintento
+# Caché en disco del token de sesión (evita pedir la portada en cada arranque)
+TOKEN_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "darkweb", "ahmia_token.json")
+TOKEN_TTL = int(os.getenv("AHMIA_TOKEN_TTL", "600")) # segundos
+# Si está activo, las seeds se cargan además directamente en MongoDB al terminar (sin seed_loader)
+AHMIA_TO_MONGO = os.getenv("AHMIA_TO_MONGO", "0") == "1"
+
+# Extracción directa del token oculto de form#searchForm (sin parsear el DOM)
+SEARCH_FORM_RE = re.compile(r'<form\b[^>]*\bid=["\']searchForm["\'][^>]*>(.*?)</form>', re.IGNORECASE | re.DOTALL)
+HIDDEN_INPUT_RE = re.compile(r'<input\b[^>]*\btype=["\']hidden["\'][^>]*>', re.IGNORECASE)
+NAME_ATTR_RE = re.compile(r'(?<![\w-])name=["\']([^"\']+)["\']', re.IGNORECASE)
+VALUE_ATTR_RE = re.compile(r'(?<![\w-])value=["\']([^"\']+)["\']', re.IGNORECASE)
 
 
 class AhmiaScraper:
     """Clase principal para manejar la sesión, la interacción HTTP y orquestar la búsqueda."""
 
-    def __init__(self, processor, wait_time=WAIT):
+    def __init__(self, processor, wait_time=WAIT, concurrency=CONCURRENCY):
         """Recibe el objeto ResultProcessor."""
         self.processor = processor
         self.wait_time = wait_time
+        self.concurrency = max(1, concurrency)
+        # Sesión HTTP compartida: reutiliza conexiones keep-alive con Ahmia
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        # Reintentos con backoff exponencial (BACKOFF_BASE * 2^n s) ante errores de red, 429 y 5xx
+        retry = Retry(total=MAX_RETRIES, backoff_factor=BACKOFF_BASE,
+                      status_forcelist=[429, 500, 502, 503, 504], raise_on_status=False)
+        self.session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=max(16, self.concurrency),
+                                                   max_retries=retry))
         self.token_key = None
         self.token_val = None
+        self._token_lock = threading.Lock()
+        # Limitador de ritmo compartido por los hilos de búsqueda
+        self._rate_lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def close(self):
+        """Cierra la sesión HTTP y sus conexiones abiertas."""
+        self.session.close()
+
+    def _wait_rate_limit(self):
+        """
+        Espacia el inicio de las peticiones a Ahmia: como mucho `concurrency`
+        búsquedas cada `wait_time` segundos, independientemente del número de hilos.
+        """
+        interval = self.wait_time / self.concurrency
+        with self._rate_lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def _extract_token_regex(self, html):
+        """Camino rápido: localiza el input oculto del formulario de búsqueda por regex."""
+        form = SEARCH_FORM_RE.search(html)
+        hidden = HIDDEN_INPUT_RE.search(form.group(1)) if form else None
+        if not hidden:
+            return None
+        name = NAME_ATTR_RE.search(hidden.group(0))
+        value = VALUE_ATTR_RE.search(hidden.group(0))
+        if not name or not value:
+            return None
+        return name.group(1), value.group(1)
+
+    def _extract_token_soup(self, html):
+        """Alternativa con BeautifulSoup si el regex no encuentra el token."""
+        # Solo se construye el subárbol del formulario de búsqueda
+        strainer = SoupStrainer("form", id="searchForm")
+        soup = BeautifulSoup(html, "lxml", parse_only=strainer)
+        form = soup.find("form", id="searchForm")
+        hidden = form.find("input", {"type": "hidden"}) if form else None
+        
+        if not hidden or not hidden.get("name") or not hidden.get("value"):
+            return None
+        return hidden["name"], hidden["value"]
+
+    def _load_cached_token(self):
+        """Devuelve (clave, valor) del token cacheado en disco si sigue dentro del TTL."""
+        try:
+            with open(TOKEN_CACHE, "rb") as f:
+                data = orjson.loads(f.read())
+            if time.time() - data["fetched_at"] < TOKEN_TTL:
+                return data["key"], data["val"]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        return None
+
+    def _save_cached_token(self):
+        """Guarda el token en disco de forma atómica (archivo temporal + os.replace)."""
+        try:
+            os.makedirs(os.path.dirname(TOKEN_CACHE), exist_ok=True)
+            tmp = TOKEN_CACHE + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(orjson.dumps({"key": self.token_key, "val": self.token_val, "fetched_at": time.time()}))
+            os.replace(tmp, TOKEN_CACHE)
+        except OSError as e:
+            print(f"[WARN] No se pudo guardar el token en caché: {e}")
+
+    def _get_session_token(self, use_cache=True):
+        """Obtiene el token de sesión necesario para las búsquedas (de la caché si es reciente)."""
+        cached = self._load_cached_token() if use_cache else None
+        if cached:
+            self.token_key, self.token_val = cached
+            print(f"[INFO] Token de sesión reutilizado de caché: {self.token_key}={self.token_val}")
+            return
 
-    def _get_session_token(self):
-        """Obtiene el token de sesión necesario para las búsquedas."""
         print("[INFO] Obteniendo token de sesión...")
         try:
-            r = requests.get(AHMIA_HOME, headers=HEADERS, timeout=20)
+            r = self.session.get(AHMIA_HOME, timeout=20)
             r.raise_for_status()
         except Exception as e:
             print(f"[ERROR] No se puede cargar la página principal de Ahmia: {e}")
             sys.exit(1)
             
-        soup = BeautifulSoup(r.text, "lxml")
-        form = soup.find("form", id="searchForm")
-        hidden = form.find("input", {"type": "hidden"}) if form else None
-        
-        if not hidden or not hidden.get("name") or not hidden.get("value"):
+        token = self._extract_token_regex(r.text) or self._extract_token_soup(r.text)
+        if not token:
             print("[ERROR] No se pudo extraer el token de sesión oculto.")
             sys.exit(1)
             
-        self.token_key = hidden["name"]
-        self.token_val = hidden["value"]
+        self.token_key, self.token_val = token
         print(f"[INFO] Token de sesión capturado: {self.token_key}={self.token_val}")
+        self._save_cached_token()
+
+    def _refresh_token(self, used_token):
+        """Renueva el token (sin caché) si nadie lo ha hecho ya desde que se usó `used_token`."""
+        with self._token_lock:
+            if (self.token_key, self.token_val) == used_token:
+                print("[WARN] Token rechazado por Ahmia. Renovando...")
+                self._get_session_token(use_cache=False)
 
     def _fetch_search_page(self, query):
         """Busca y obtiene los resultados de una consulta."""
         if not self.token_key or not self.token_val:
             self._get_session_token()
 
-        params = {"q": query, self.token_key: self.token_val}
-        url = urljoin(AHMIA_HOME, "search/") + "?" + urlencode(params)
+        token = (self.token_key, self.token_val)
+        url = urljoin(AHMIA_HOME, "search/") + "?" + urlencode({"q": query, token[0]: token[1]})
+        refreshed = False
         
-        try:
-            r = requests.get(url, headers=HEADERS, timeout=30)
-            r.raise_for_status()
-            return r.text
-        except Exception as e:
-            print(f"[WARN] Error al buscar {url}: {e}")
-            return None
+        # Los reintentos con backoff (red, 429 y 5xx) los hace el Retry del adaptador;
+        # aquí solo se repite una vez si hay que renovar el token.
+        while True:
+            self._wait_rate_limit()
+            try:
+                r = self.session.get(url, timeout=30)
+                r.raise_for_status()
+                # Bytes crudos: el extractor de .onion trabaja sin decodificar ni parsear
+                return r.content
+            except Exception as e:
+                # Un 4xx suele indicar token caducado (p.ej. el de la caché): se renueva una vez
+                resp = getattr(e, "response", None)
+                if not refreshed and resp is not None and 400 <= resp.status_code < 500 and resp.status_code != 429:
+                    refreshed = True
+                    self._refresh_token(token)
+                    token = (self.token_key, self.token_val)
+                    url = urljoin(AHMIA_HOME, "search/") + "?" + urlencode({"q": query, token[0]: token[1]})
+                    continue
+                print(f"[WARN] Error al buscar {url}: {e}")
+                return None
+
+    def _process_results(self, pairs, query, html):
+        """Extrae los .onion del HTML de resultados (bytes) y los registra para cada (raíz, término) de la consulta."""
+        if not html:
+            print(f"  [INFO] Búsqueda fallida para '{query}'. Saltando.")
+            return
+
+        # Usa el ResultProcessor para analizar el HTML
+        onions = self.processor.extract_onions_from_html(html)
+        
+        if not onions:
+            print(f"  [INFO] No se encontraron resultados .onion para '{query}'")
+        else:
+            print(f"  [INFO] Encontrados {len(onions)} hosts para '{query}'")
+            for root, term in pairs:
+                for host in onions:
+                    # Usa el ResultProcessor para almacenar el resultado
+                    self.processor.record_host(host, root, term)
 
     def run_search(self):
-        """Ejecuta el proceso de búsqueda para todos los términos."""
+        """
+        Ejecuta el proceso de búsqueda para todos los términos (una petición por término único).
+        Devuelve la lista de seeds escrita en seeds_with_terms.json.
+        """
         self._get_session_token()
         
-        term_list = self.processor.term_list 
+        search_terms = list(self.processor.search_terms.items())
+        print(f"[INFO] Lanzando búsquedas con {self.concurrency} hilos (máx. {self.concurrency} cada {self.wait_time}s)")
         
-        for idx, (root, term) in enumerate(term_list, 1):
-            print(f"\n[{idx}/{len(term_list)}] Buscando término='{term}' (raíz={root})")
-            
-            html = self._fetch_search_page(term)
-            
-            if not html:
-                print(f"  [INFO] Búsqueda fallida para '{term}'. Saltando.")
-            else:
-                # Usa el ResultProcessor para analizar el HTML
-                onions = self.processor.extract_onions_from_html(html)
-                
-                if not onions:
-                    print(f"  [INFO] No se encontraron resultados .onion para '{term}'")
-                else:
-                    print(f"  [INFO] Encontrados {len(onions)} hosts para '{term}'")
-                    for host in onions:
-                        # Usa el ResultProcessor para almacenar el resultado
-                        self.processor.record_host(host, root, term)
-            
-            # Espera entre búsquedas
-            print(f"  [INFO] Espera '{self.wait_time}' segundos")
-            time.sleep(self.wait_time)
+        # Las peticiones se hacen en paralelo; el procesado de resultados se mantiene
+        # en el hilo principal y en el orden original de los términos.
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            pages = executor.map(lambda item: self._fetch_search_page(item[0]), search_terms)
+            for idx, ((query, pairs), html) in enumerate(zip(search_terms, pages), 1):
+                roots = dict.fromkeys(root for root, _ in pairs)
+                print(f"\n[{idx}/{len(search_terms)}] Resultados término='{query}' (raíces={', '.join(roots)})")
+                self._process_results(pairs, query, html)
             
         print("\n[INFO] Proceso de scraping finalizado. Generando salidas...")
         # Usa el ResultProcessor para generar los archivos
-        self.processor.output_results()
+        return self.processor.output_results()
 
 
 # --- Funciones de Orquestación y Ejecución ---
@@ -120,11 +249,31 @@ def main_oop():
     processor = ResultProcessor(syn_file=SYN_FILE)
     
     # 2. Crear el objeto que hace las búsquedas, inyectándole el procesador
-    scraper = AhmiaScraper(processor=processor, wait_time=WAIT)
+    scraper = AhmiaScraper(processor=processor, wait_time=WAIT, concurrency=CONCURRENCY)
     
     # 3. Iniciar el proceso
-    scraper.run_search()
+    try:
+        seeds = scraper.run_search()
+    finally:
+        scraper.close()
+
+    # 4. (Opcional) Cargar las seeds en MongoDB sin volver a leer el JSON
+    if AHMIA_TO_MONGO and seeds:
+        load_seeds_into_mongo(seeds)
+
+def load_seeds_into_mongo(seeds):
+    """Carga las seeds en MongoDB con el mismo upsert masivo que seed_loader (requiere PYTHONPATH=.)."""
+    try:
+        from src.persistence.mongo_controller import mongo_session
+    except ImportError as e:
+        print(f"[ERROR] No se pudo importar MongoController (¿PYTHONPATH=. ?): {e}")
+        return
+    with mongo_session() as mc:
+        loaded = mc.load_seeds(seeds)
+    print(f"[INFO] Seeds cargadas en MongoDB: {loaded}")
 
 
 if __name__ == "__main__":
+    # Logging de MongoController (el script usa print para su propia salida)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s [%(name)s] %(message)s")
     main_oop()
\ No newline at end of file
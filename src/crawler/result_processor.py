@@ -1,12 +1,14 @@
 import re
 import sys
-import json
 import os
-from bs4 import BeautifulSoup
-from urllib.parse import urlparse, parse_qs, unquote
+import orjson
+from urllib.parse import unquote_to_bytes
 
 # --- Constantes (ajustadas para la ruta) ---
-ONION_RE = re.compile(r'\b([a-z2-7]{16,56}\.onion)\b', re.IGNORECASE)
+# Patrones sobre bytes ya pasados a minúsculas: sin IGNORECASE ni lógica Unicode.
+ONION_RE = re.compile(rb'\b([a-z2-7]{16,56}\.onion)\b', re.ASCII)
+# Valor del parámetro redirect_url en los enlaces de Ahmia ("&" puede venir como "&amp;")
+REDIRECT_RE = re.compile(rb'[?&;]redirect_url=([^&\s"\'<>]+)', re.ASCII)
 
 OUTPUT_DIR_NAME = "output_ahmia"
 OUTPUT_DIR = os.path.join(OUTPUT_DIR_NAME)
@@ -22,87 +24,93 @@ class ResultProcessor:
     """
     def __init__(self, syn_file=SYN_FILE):
         self.syn_file = syn_file
-        self.hosts_map = {}
+        # Registro plano de hits únicos (host, raíz, término); un dict hace de conjunto
+        # ordenado para conservar el orden de aparición en la salida.
+        self.hits = {}
         self.total_found = 0
         self.synmap = {}
         self.term_list = []
+        self.search_terms = {}
         self._load_synonyms()
         self._build_term_list()
 
     def _load_synonyms(self):
         """Carga el mapeo de sinónimos desde el archivo."""
         try:
-            with open(self.syn_file, encoding='utf-8') as f:
-                self.synmap = json.load(f)
+            with open(self.syn_file, "rb") as f:
+                self.synmap = orjson.loads(f.read())
         except FileNotFoundError:
             print(f"[ERROR] Archivo {self.syn_file} no encontrado. Crea: {{raiz: [sin1, sin2, ...]}}")
             sys.exit(1)
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             print(f"[ERROR] Error al decodificar JSON en {self.syn_file}.")
             sys.exit(1)
         print(f"[INFO] Sinónimos cargados desde {self.syn_file}")
 
     def _build_term_list(self):
-        """Construye la lista de términos de búsqueda [(raiz, término)]."""
+        """
+        Construye la lista de términos [(raiz, término)] y el mapa de búsquedas
+        únicas {consulta: [(raiz, término)]}. Los términos que solo difieren en
+        mayúsculas/espacios (la búsqueda de Ahmia no los distingue) se consultan
+        una sola vez, aunque cada par se registre con su término original.
+        """
+        queries = {}  # clave normalizada -> consulta (primera grafía vista)
         for root, syns in self.synmap.items():
-            self.term_list.append((root, root))
-            for s in syns:
-                self.term_list.append((root, s))
-        print(f"[INFO] Total de términos a buscar: {len(self.term_list)}")
+            for term in (root, *syns):
+                self.term_list.append((root, term))
+                key = " ".join(term.split()).casefold()
+                query = queries.setdefault(key, term)
+                pairs = self.search_terms.setdefault(query, [])
+                if (root, term) not in pairs:
+                    pairs.append((root, term))
+        print(f"[INFO] Total de términos: {len(self.term_list)} | Búsquedas únicas: {len(self.search_terms)}")
 
-    def extract_onions_from_html(self, html):
-        """Analiza y extrae .onion del HTML."""
-        if not html:
+    def extract_onions_from_html(self, html_bytes):
+        """
+        Extrae los .onion del HTML crudo (bytes).
+
+        El regex se pasa directamente sobre el documento: cubre tanto los hrefs
+        como el texto visible, sin construir el árbol DOM. Los `redirect_url`
+        se localizan también por regex y solo esos valores se decodifican.
+        """
+        if not html_bytes:
             return set()
-        
-        onions = set()
-        soup = BeautifulSoup(html, "lxml")
-        text = soup.get_text(" ")
 
-        # 1. Matches directos en hrefs y texto
-        for a in soup.find_all("a", href=True):
-            href = a["href"]
-            m = ONION_RE.search(href)
+        # 1. Matches directos en el HTML crudo (hrefs y texto), en minúsculas una sola vez
+        html = html_bytes.lower()
+        onions = {m.group(1).decode("ascii") for m in ONION_RE.finditer(html)}
+
+        # 2. Matches en parámetros de URL de redirección (pueden venir percent-encoded)
+        for r in REDIRECT_RE.finditer(html):
+            m = ONION_RE.search(unquote_to_bytes(r.group(1)).lower())
             if m:
-                onions.add(m.group(1).lower())
-        
-        # 2. Matches en texto crudo
-        for m in ONION_RE.finditer(text):
-             onions.add(m.group(1).lower())
-            
-        # 3. Matches en parámetros de URL de redirección
-        for a in soup.find_all("a", href=True):
-            href = a["href"]
-            try:
-                parsed = urlparse(href)
-                qs = parse_qs(parsed.query)
-                if "redirect_url" in qs:
-                    rv = unquote(qs["redirect_url"][0])
-                    m = ONION_RE.search(rv)
-                    if m:
-                        onions.add(m.group(1).lower())
-            except Exception:
-                pass
+                onions.add(m.group(1).decode("ascii"))
                 
         return onions
 
     def record_host(self, host, root, term):
         """Guarda la información de un host detectado."""
         self.total_found += 1
-        self.hosts_map.setdefault(host, {}).setdefault(root, set()).add(term)
+        self.hits[(host, root, term)] = None
 
     def output_results(self, output_hosts=OUTPUT_HOSTS, output_seeds=OUTPUT_SEEDS):
-        """Escribe los resultados a archivos JSON."""
+        """Escribe los resultados a archivos JSON y devuelve la lista de seeds generada."""
+        # Agrupación en una sola pasada: {host: {raíz: [términos]}}
+        grouped = {}
+        for host, root, term in self.hits:
+            grouped.setdefault(host, {}).setdefault(root, []).append(term)
+
         hosts_terms = {}
         seeds_list = []
         
-        for host, roots_dict in self.hosts_map.items():
+        for host, roots_dict in grouped.items():
             arr = []
-            for root, synset in roots_dict.items():
+            for root, terms in roots_dict.items():
+                terms.sort()
                 arr.append({
                     "root": root,
-                    "synonyms": sorted(list(synset)), 
-                    "is_root": root in synset
+                    "synonyms": terms, 
+                    "is_root": root in terms
                 })
             
             hosts_terms[host] = arr
@@ -113,17 +121,18 @@ class ResultProcessor:
             })
         
         try:
-            with open(output_hosts, "w", encoding='utf-8') as f:
-                json.dump(hosts_terms, f, indent=2, ensure_ascii=False)
+            with open(output_hosts, "wb") as f:
+                f.write(orjson.dumps(hosts_terms, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
             print(f"[INFO] Hosts y términos escritos en: {output_hosts}")
         except Exception as e:
             print(f"[ERROR] Error al escribir {output_hosts}: {e}")
 
         try:
-            with open(output_seeds, "w", encoding='utf-8') as f:
-                json.dump(seeds_list, f, indent=2, ensure_ascii=False)
+            with open(output_seeds, "wb") as f:
+                f.write(orjson.dumps(seeds_list, option=orjson.OPT_INDENT_2))
             print(f"[INFO] Seeds escritos en: {output_seeds}")
         except Exception as e:
             print(f"[ERROR] Error al escribir {output_seeds}: {e}")
             
-        print(f"[DONE] Hosts detectados: {len(hosts_terms)} | Total hits (raw): {self.total_found}")
\ No newline at end of file
+        print(f"[DONE] Hosts detectados: {len(hosts_terms)} | Total hits (raw): {self.total_found}")
+        return seeds_list
@@ -2,26 +2,28 @@
 """
 Script de entrada para cargar seeds desde seeds_with_terms.json en MongoDB, 
 utilizando la funcionalidad de carga masiva de la clase MongoController.
+
+Los upserts se apoyan en el índice único sobre `url` de la colección de seeds,
+que MongoController crea al inicializarse.
 """
 import os
 import sys
+import logging
 from pymongo.errors import ConnectionFailure
-from ..persistence.mongo_controller import MongoController 
+from ..persistence.mongo_controller import mongo_session
 
 # --- CONFIGURACIÓN ---
 SEEDS_FILE = os.getenv("SEEDS_FILE", "output_ahmia/seeds_with_terms.json")
 
 def main():
     """Función principal para ejecutar la carga."""
-    mc = None
     try:
-        # 1. Crea la instancia de MongoController, estableciendo la conexión
-        mc = MongoController()
-        
-        print(f"[INFO] Intentando cargar semillas desde: {SEEDS_FILE}")
-        
-        # 2. Ejecuta la carga masiva usando el método centralizado
-        loaded_count = mc.load_seeds_bulk(SEEDS_FILE)
+        # 1. Obtiene un MongoController sobre el cliente compartido del proceso
+        with mongo_session() as mc:
+            print(f"[INFO] Intentando cargar semillas desde: {SEEDS_FILE}")
+            
+            # 2. Ejecuta la carga masiva usando el método centralizado
+            loaded_count = mc.load_seeds_bulk(SEEDS_FILE)
         
         if loaded_count > 0:
             print(f"[DONE] Proceso de carga finalizado. {loaded_count} documentos procesados.")
@@ -35,12 +37,9 @@ def main():
         sys.exit(1)
     except Exception as e:
         print(f"[ERROR] Error inesperado en el cargador: {e}")
-    finally:
-        # 3. Asegura el cierre de la conexión
-        if mc:
-            mc.close()
-            print("[INFO] Conexión a MongoDB cerrada.")
 
 
 if __name__ == '__main__':
+    # Logging de MongoController (el script usa print para su propia salida)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s [%(name)s] %(message)s")
     main()
\ No newline at end of file
@@ -4,23 +4,108 @@ import os
 import time
 import re
 import hashlib
+import codecs
 import logging
 import signal
 import sys
-from datetime import datetime
-from urllib.parse import urljoin, urlparse
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
 
 import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException, ConnectionError, Timeout
-from bs4 import BeautifulSoup
+import lxml.html
+from lxml import etree
 
 # Importamos los controladores de los otros python.
-from ..persistence.mongo_controller import MongoController, RESET_INPROGRESS_OLDER_MIN 
+from ..persistence.mongo_controller import MongoController, RESET_INPROGRESS_OLDER_MIN, host_of
 from ..persistence.neo_controller import NeoController
 from ..persistence.neo_ingest_server import NeoIngestServer 
 
-# Logging simple (el resto de módulos usan el suyo propio)
-logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s [TOR] %(message)s")
+# Logger del módulo; la configuración (handlers, formato) la hace solo el punto de entrada
+logger = logging.getLogger(__name__)
+
+
+# Bloques <script>/<style> completos: se quitan de los bytes antes de parsear (no aportan
+# texto y el sanitizador los eliminaría igualmente)
+SCRIPT_STYLE_RE = re.compile(rb'<(script|style)\b[^>]*>.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+
+# Hosts .onion válidos. Se aplica a hostnames, que urlsplit ya devuelve en minúsculas:
+# sin IGNORECASE ni Unicode
+ONION_RE = re.compile(r'\b([a-z2-7]{16,56}\.onion)\b', re.ASCII)
+# href absoluto (con esquema o "//host"); el resto son relativos al host de la página
+ABSOLUTE_HREF_RE = re.compile(r'\s*(?:[a-zA-Z][a-zA-Z0-9+.-]*:|//)')
+
+# Atributos que se eliminan de todos los tags al sanitizar (además de los on*)
+ATTRS_TO_REMOVE = frozenset(('style', 'src', 'srcset', 'href', 'data'))
+# Atributos manejadores de eventos (onclick, onload, ...)
+ON_ATTRS_XPATH = etree.XPath("//@*[starts-with(name(), 'on')]")
+# Tags que se eliminan con todo su contenido al sanitizar
+TAGS_TO_KILL = ('script', 'style', 'noscript', 'iframe', 'form', 'object', 'embed')
+
+# Envoltorio del snapshot sanitizado (el cuerpo limpio va entre ambos)
+SNAPSHOT_HEAD = """<!doctype html>
+            <html>
+            <head>
+            <meta charset="utf-8"/>
+            <meta http-equiv="Content-Security-Policy" content="default-src 'none'; style-src 'self' 'unsafe-inline';">
+            <title>Sanitized snapshot</title>
+            </head>
+            <body>
+            <p><em>Snapshot sanitized — no scripts, iframes, forms, src/href removed.</em></p>
+            """.encode('utf-8')
+SNAPSHOT_TAIL = b"""
+            </body>
+            </html>"""
+
+# Parsers HTML de lxml por codificación (None = detección por <meta charset>)
+_HTML_PARSERS = {}
+
+def _html_parser(encoding):
+    """
+    Parser lxml reutilizable por codificación. La clave es el nombre canónico del códec,
+    así el caché queda acotado aunque cada servidor escriba el charset a su manera; un
+    charset desconocido (o que libxml2 no acepta) cae al parser con autodetección.
+    """
+    if encoding:
+        try:
+            encoding = codecs.lookup(encoding).name
+        except LookupError:
+            encoding = None
+    parser = _HTML_PARSERS.get(encoding)
+    if parser is None:
+        try:
+            parser = lxml.html.HTMLParser(encoding=encoding)
+        except LookupError:
+            return _html_parser(None)
+        _HTML_PARSERS[encoding] = parser
+    return parser
+
+def parse_html(body, encoding=None):
+    """Parsea el HTML (bytes) con lxml. Devuelve el elemento raíz o None si no hay documento."""
+    parser = _html_parser(encoding)
+    try:
+        return lxml.html.document_fromstring(body, parser=parser)
+    except (etree.ParserError, ValueError, LookupError):
+        return None
+
+def extract_text(tree, limit):
+    """
+    Texto visible del árbol con los espacios normalizados, cortado a `limit` caracteres.
+    Deja de recorrer el árbol al llegar al límite en lugar de construir el texto completo.
+    """
+    parts, total = [], 0
+    for chunk in tree.itertext():
+        chunk = " ".join(chunk.split())
+        if chunk:
+            parts.append(chunk)
+            total += len(chunk) + 1
+            if total > limit:
+                break
+    return " ".join(parts)[:limit]
 
 
 # ---------------- CLASE TOR CONTROLLER ----------------
@@ -36,331 +121,532 @@ class TorController:
         self.proxies = {'http': 'socks5h://127.0.0.1:9050', 'https': 'socks5h://127.0.0.1:9050'}
         self.user_agents = [os.getenv("USER_AGENT", "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/100.0.4896.127 Safari/537.36")]
         self.min_text_chars = int(os.getenv("MIN_TEXT_CHARS", "1200"))
+        self.max_bytes = int(os.getenv("TOR_MAX_BYTES", str(2 * 1024 * 1024)))
+        # Caracteres de texto que se envían a Neo por página
+        self.max_text_chars = int(os.getenv("MAX_TEXT_CHARS", "10000"))
         
         # --- Límites ---
         self.max_pages_to_fetch = sys.maxsize
         self.max_depth = 20
         
+        # Pausa mínima entre dos peticiones al mismo host (los hosts distintos no esperan)
         self.sleep = float(os.getenv("SLEEP", "3.5"))
+        self._next_fetch = {}  # {host: time.monotonic() a partir del cual se le puede volver a pedir}
+        self._host_lock = threading.Lock()
         self.max_attempts = int(os.getenv("MAX_ATTEMPTS", "4"))
-        self.onion_re = re.compile(r'\b([a-z2-7]{16,56}\.onion)\b', re.IGNORECASE)
+        # Páginas acumuladas antes de enviarlas juntas al servidor de ingesta
+        self.batch_size = max(1, int(os.getenv("NEO_BATCH_SIZE", "25")))
+        # Descargas por Tor simultáneas (cada ronda saca de Mongo hasta este número de seeds)
+        self.fetch_workers = max(1, int(os.getenv("TOR_FETCH_WORKERS", "8")))
+        # Antigüedad máxima (s) del lote: con pocas páginas válidas no se retienen indefinidamente
+        self.batch_max_age = float(os.getenv("NEO_BATCH_MAX_AGE", "60"))
+        self._pending_batch = {}  # {url: (payload, campos para mark_done)}
+        self._batch_started = 0.0  # time.monotonic() de la primera página del lote actual
+        # Caché LRU huella de contenido -> ID en GridFS (sitios espejo con el mismo HTML)
+        self.snapshot_cache_size = max(1, int(os.getenv("SNAPSHOT_CACHE_SIZE", "512")))
+        self._snapshot_cache = OrderedDict()
+        self._pending_transitions = []  # (url, estado, campos) de descartes/fallos aún sin enviar
         
         self.running = True
         
+        # Sesión HTTP persistente sobre Tor: reutiliza las conexiones SOCKS (y sus circuitos)
+        # mediante keep-alive en lugar de abrir una nueva por cada petición.
+        self.session = requests.Session()
+        self.session.proxies.update(self.proxies)
+        self.session.headers.update({'User-Agent': self.user_agents[0]})
+        self.session.verify = False
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(16, self.fetch_workers), max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._fetch_pool = ThreadPoolExecutor(max_workers=self.fetch_workers, thread_name_prefix="tor-fetch")
+        
         # --- Inicialización de Controladores ---
         self.mongo_db = MongoController()
 
-        # 1. INICIAR EL SERVIDOR DE INGESTA DE NEO4J EN UN HILO
-        self.neo_server = NeoIngestServer()
-        self.neo_server.start()
-        
-        # 2. ESPERAR UN MOMENTO para que el servidor Flask se levante
-        logging.info("Iniciando servidor Neo4j en segundo plano. Esperando 3 segundos...")
-        time.sleep(3)
+        # 1. INICIAR EL SERVIDOR DE INGESTA DE NEO4J EN UN HILO (salvo que se use uno externo,
+        #    p.ej. `make run-neo-ingest` con gunicorn: NEO_EMBEDDED_SERVER=0)
+        self.neo_server = None
+        if os.getenv("NEO_EMBEDDED_SERVER", "1") == "1":
+            self.neo_server = NeoIngestServer()
+            self.neo_server.start()
+            logger.info("Iniciando servidor Neo4j en segundo plano...")
         
-        # 3. Inicializar el CLIENTE NeoController
+        # 2. Inicializar el CLIENTE NeoController y esperar a que el servidor responda
+        #    (sondeo de /health en lugar de una pausa fija)
         self.neo_db = NeoController()
+        if not self.neo_db.wait_until_ready(float(os.getenv("NEO_READY_TIMEOUT", "30"))):
+            logger.warning("El servidor de ingesta no responde en %s; las páginas se reintentarán.", self.neo_db.health_url)
         
         # Manejo de señal
         signal.signal(signal.SIGINT, self.handle_sigint)
         
-        logging.info("TorController inicializado. Conexiones a DB y Servidor Neo activo.")
+        logger.info("TorController inicializado. Conexiones a DB y Servidor Neo activo.")
 
     def handle_sigint(self, signum, frame):
         """Maneja la señal SIGINT para una parada ordenada."""
-        logging.info("SIGINT recibido: preparando parada ordenada...")
+        logger.info("SIGINT recibido: preparando parada ordenada...")
         self.running = False
         
     # --- MÉTODOS DE CRAWLING ---
     
+    def _wait_for_host(self, url):
+        """
+        Respeta la pausa entre peticiones al mismo host. Reserva el siguiente hueco del host
+        bajo el lock y duerme fuera de él, así los hilos de otros hosts no se bloquean.
+        """
+        host = host_of(url)
+        with self._host_lock:
+            now = time.monotonic()
+            if len(self._next_fetch) > 10000:
+                # Olvida los hosts cuya pausa ya ha vencido
+                self._next_fetch = {h: t for h, t in self._next_fetch.items() if t > now}
+            start = max(now, self._next_fetch.get(host, 0.0))
+            self._next_fetch[host] = start + self.sleep
+        if start > now:
+            time.sleep(start - now)
+
     def fetch_via_tor(self, url): 
-        """Realiza la petición HTTP a través de Tor."""
-        headers = {'User-Agent': self.user_agents[0]}
+        """
+        Realiza la petición HTTP a través de Tor. Devuelve (respuesta, cuerpo en bytes) o None.
+        El cuerpo se lee en streaming y se corta en max_bytes para no descargar páginas enormes.
+        """
+        self._wait_for_host(url)
         try:
-            r = requests.get(url, headers=headers, proxies=self.proxies, timeout=(self.connect_timeout, self.read_timeout), verify=False)
-            r.raise_for_status() 
-            return r
+            with self.session.get(url, timeout=(self.connect_timeout, self.read_timeout), stream=True) as r:
+                r.raise_for_status() 
+                chunks, size = [], 0
+                for chunk in r.iter_content(chunk_size=64 * 1024):
+                    chunks.append(chunk)
+                    size += len(chunk)
+                    if size >= self.max_bytes:
+                        logger.debug("Cuerpo truncado a %d bytes para %s", self.max_bytes, url)
+                        break
+                return r, b"".join(chunks)[:self.max_bytes]
         except (Timeout, ConnectionError, RequestException) as e:
-            logging.debug("fetch error %s para %s", type(e).__name__, url)
+            logger.debug("fetch error %s para %s", type(e).__name__, url)
         except Exception as e:
-            logging.debug("fetch error Inesperado %s : %s", url, e)
+            logger.debug("fetch error Inesperado %s : %s", url, e)
         return None
 
+    def _queue_transition(self, url, state, extra):
+        """Encola un cambio de estado de seed (descarte/fallo); se envía en bloque con el lote."""
+        self._pending_transitions.append((url, state, extra))
+        if len(self._pending_transitions) >= self.batch_size:
+            self._flush_transitions()
+
+    def _flush_transitions(self, extra_transitions=()):
+        """Envía en un solo bulk_write los cambios de estado encolados (más los indicados)."""
+        transitions, self._pending_transitions = self._pending_transitions, []
+        transitions.extend(extra_transitions)
+        self.mongo_db.bulk_transition(transitions)
+
+    def _discard(self, url, reason):
+        """Marca la seed como 'discarded' (diferido, ver _queue_transition)."""
+        logger.info("URL %s MARCADA como 'discarded' (Razón: %s).", url, reason)
+        self._queue_transition(url, "discarded", {"discard_reason": reason})
+
+    def _flush_batch(self):
+        """
+        Envía las páginas pendientes en un único POST a /ingest_pages.
+        Si la ingesta es correcta las marca 'ingested' en bloque y devuelve el nuevo
+        valor del contador; si falla, las devuelve todas a 'pending' y devuelve None.
+        Los descartes y fallos encolados se envían en el mismo bulk_write.
+        """
+        # Las seeds descubiertas se vuelcan aunque falle la ingesta: los enlaces siguen siendo válidos
+        self.mongo_db.flush_seeds()
+        if not self._pending_batch:
+            self._flush_transitions()
+            return None
+        batch, self._pending_batch = self._pending_batch, {}
+        self._batch_started = 0.0
+
+        resp = self.neo_db.post_pages_payload([payload for payload, _ in batch.values()])
+        if resp is None or resp.status_code != 200:
+            logger.warning("Neo ingest devolvió %s o falló para %d páginas -> reintentando más tarde",
+                            resp.status_code if resp else "No response", len(batch))
+            self._flush_transitions()
+            self.mongo_db.revert_many_to_pending(batch.keys())
+            return None
+
+        logger.info("Ingestadas en Neo %d páginas.", len(batch))
+        self._flush_transitions((url, "ingested", fields) for url, (_, fields) in batch.items())
+        return self.mongo_db.inc_processed(len(batch))
+
+    def _snapshot_for(self, content_hash):
+        """ID del snapshot ya guardado con ese contenido (caché local y, si no, GridFS) o None."""
+        file_id = self._snapshot_cache.get(content_hash)
+        if file_id is None:
+            found = self.mongo_db.find_html_by_content_hash(content_hash)
+            if found is None:
+                return None
+            file_id = str(found)
+        self._remember_snapshot(content_hash, file_id)
+        return file_id
+
+    def _remember_snapshot(self, content_hash, file_id):
+        """Guarda la huella en la caché LRU local de snapshots."""
+        self._snapshot_cache[content_hash] = file_id
+        self._snapshot_cache.move_to_end(content_hash)
+        if len(self._snapshot_cache) > self.snapshot_cache_size:
+            self._snapshot_cache.popitem(last=False)
+
     # --- MÉTODOS DE APOYO A LA SANITIZACIÓN (Para reducir complejidad) ---
 
-    def _remove_dangerous_tags(self, soup):
-        """Elimina tags peligrosos como scripts, forms, etc."""
-        tags_to_kill = ['script', 'style', 'noscript', 'iframe', 'form', 'object', 'embed']
-        for tag in soup.find_all(tags_to_kill):
-            tag.decompose()
+    def _remove_dangerous_tags(self, tree):
+        """Elimina tags peligrosos como scripts, forms, etc. (y los comentarios)."""
+        # with_tail=False: el texto que sigue al tag eliminado se conserva
+        etree.strip_elements(tree, etree.Comment, *TAGS_TO_KILL, with_tail=False)
 
-    def _neutralize_media_and_links(self, soup):
+    def _neutralize_media_and_links(self, tree):
         """Reemplaza imágenes por texto y rompe enlaces."""
-        for img in soup.find_all('img'):
+        for img in list(tree.iter('img')):
             alt = img.get('alt', '[imagen]')
-            img.replace_with(f" [IMG: {alt}] ")
+            img.clear(keep_tail=True)
+            img.tag = 'span'
+            img.text = f" [IMG: {alt}] "
             
-        for a in soup.find_all('a'):
-            if a.contents:
-                a.replace_with(*a.contents)
-            else:
-                a.decompose()
+        # Los <a> se desenvuelven: su contenido pasa al padre (y los vacíos desaparecen)
+        etree.strip_tags(tree, 'a')
 
-    def _clean_attributes(self, soup):
+    def _clean_attributes(self, tree):
         """Limpia atributos peligrosos (onmouseover, src, etc.) de todos los tags."""
-        event_attrs = re.compile(r'^on', re.IGNORECASE)
-        attrs_to_remove = ('style', 'src', 'srcset', 'href', 'data')
-        
-        for tag in soup.find_all(True):
-            to_del = [attr for attr in tag.attrs if event_attrs.match(attr) or attr.lower() in attrs_to_remove]
-            for attr in to_del:
-                try:
-                    del tag.attrs[attr]
-                except Exception:
-                    pass
+        # Atributos fijos: una sola pasada en C sobre todo el árbol
+        etree.strip_attributes(tree, *ATTRS_TO_REMOVE)
+        # Manejadores on*: el XPath solo devuelve los atributos afectados, sin recorrer
+        # cada tag en Python (el parser HTML de lxml ya los entrega en minúsculas)
+        for attr in ON_ATTRS_XPATH(tree):
+            attr.getparent().attrib.pop(attr.attrname, None)
 
     def sanitize_html(self, raw_html):
-        """Sanitiza el HTML para almacenamiento seguro y análisis de texto."""
-        try:
-            soup = BeautifulSoup(raw_html, "lxml")
-        except Exception:
-            soup = BeautifulSoup(raw_html, "html.parser")
+        """
+        Sanitiza el HTML para almacenamiento seguro y análisis de texto.
+        Acepta el HTML en bruto o un árbol lxml ya parseado (que se modifica en el sitio).
+        Devuelve el documento limpio en bytes UTF-8.
+        """
+        tree = raw_html if isinstance(raw_html, etree._Element) else parse_html(raw_html)
+
+        safe_body = b""
+        if tree is not None:
+            # Llamamos a las mini-funciones
+            self._remove_dangerous_tags(tree)
+            self._neutralize_media_and_links(tree)
+            
+            # Eliminar meta refresh
+            for meta in list(tree.iter('meta')):
+                if 'refresh' in (meta.get('http-equiv') or '').lower():
+                    meta.drop_tree()
 
-        # Llamamos a las mini-funciones
-        self._remove_dangerous_tags(soup)
-        self._neutralize_media_and_links(soup)
-        
-        # Eliminar meta refresh
-        for meta in soup.find_all('meta', attrs={'http-equiv': re.compile(r'refresh', re.I)}):
-            meta.decompose()
+            self._clean_attributes(tree)
 
-        self._clean_attributes(soup)
+            body = tree.find('body')
+            # Serializado directamente a UTF-8: GridFS recibe los bytes sin otra copia en str
+            safe_body = lxml.html.tostring(body if body is not None else tree, encoding='utf-8', with_tail=False)
 
         # Ensamblaje del HTML limpio
-        safe_body = soup.body or soup
-        return f"""<!doctype html>
-            <html>
-            <head>
-            <meta charset="utf-8"/>
-            <meta http-equiv="Content-Security-Policy" content="default-src 'none'; style-src 'self' 'unsafe-inline';">
-            <title>Sanitized snapshot</title>
-            </head>
-            <body>
-            <p><em>Snapshot sanitized — no scripts, iframes, forms, src/href removed.</em></p>
-            {str(safe_body)}
-            </body>
-            </html>"""
+        return b"".join((SNAPSHOT_HEAD, safe_body, SNAPSHOT_TAIL))
 
     # --- MÉTODO PRINCIPAL ----
     
-    def start_crawling(self):
-        """Bucle principal del crawler."""
-        
-        logging.info("Resetting stale in_progress seeds older than %d minutes...", RESET_INPROGRESS_OLDER_MIN)
-        self.mongo_db.reset_stale_inprogress()
-
-        while self.running:
-            
-            # 1. Chequeo del límite 
-            current_count = self.mongo_db.get_current_processed_count() 
-            if current_count >= self.max_pages_to_fetch:
-                 logging.warning(f"Límite de {self.max_pages_to_fetch} páginas alcanzado ({current_count}). DETENIENDO CRAWLER.")
-                 break 
-
+    def _claim_seeds(self):
+        """
+        Saca de Mongo hasta fetch_workers seeds listas para descargar.
+        Las que no necesitan fetch (demasiados intentos, sin términos) se resuelven aquí.
+        Devuelve (lista de (seed, pares (root, sinónimo)), si se sacó alguna seed).
+        """
+        work, popped = [], False
+        while len(work) < self.fetch_workers and self.running:
             seed = self.mongo_db.pop_next_seed()
             if not seed:
-                logging.info("No pending seeds. Esperando %s s...", self.sleep)
-                time.sleep(self.sleep)
-                continue
+                break
+            popped = True
 
             url = seed.get("url")
             attempts = seed.get("attempts", 0)
-            current_page_depth = seed.get("depth", 0)
             current_seed_detected = seed.get("detected")
             
-            logging.info("Procesando seed: %s (attempts=%d, depth=%d)", url, attempts, current_page_depth)
+            logger.info("Procesando seed: %s (attempts=%d, depth=%d)", url, attempts, seed.get("depth", 0))
 
             # Si ya ha fallado demasiadas veces
             if attempts > self.max_attempts:
-                self.mongo_db.mark_failed(url, "max_attempts_reached")
-                time.sleep(self.sleep)
+                logger.info("Semilla %s MARCADA como 'failed_perm' (Razón: max_attempts_reached).", url)
+                self._queue_transition(url, "failed_perm", {"failed_reason": "max_attempts_reached"})
                 continue
 
-            # ---------------- FASE DE FETCH Y FILTRADO ----------------
-            r = self.fetch_via_tor(url)
-            
-            # Manejo de fallos en la petición
-            if not r or not r.text:
-                logging.info("Falló fetch para %s", url)
-                self.mongo_db.revert_to_pending(url) 
-                time.sleep(self.sleep)
+            # FILTRADO 2: Sin términos coincidentes. Solo depende de la seed, así que se
+            # evalúa antes de descargar, parsear, sanitizar y guardar nada.
+            matched_pairs = [
+                (d.get("root", ""), syn)
+                for d in (current_seed_detected or ())
+                for syn in d.get("synonyms", [])
+            ]
+            if not matched_pairs:
+                logger.warning("DIAGNÓSTICO: 'matched_terms' está vacío para %s. Saltando fetch y Neo4j, MARCANDO como 'discarded'.", url)
+                self._discard(url, "no_matching_terms_propagated")
+                if self.mongo_db.inc_processed() >= self.max_pages_to_fetch:
+                    break
                 continue
 
-            html = r.text
-            raw_soup = BeautifulSoup(html, "lxml")
-            # Extraer texto y normalizar múltiples espacios
-            text = " ".join(raw_soup.get_text(" ").split()) 
+            work.append((seed, matched_pairs))
+        return work, popped
+
+    def _process_page(self, seed, matched_pairs, fetched):
+        """
+        Filtra, extrae, guarda y encola para Neo una página ya descargada.
+        Devuelve True si se ha alcanzado el límite de páginas.
+        """
+        url = seed.get("url")
+        current_page_depth = seed.get("depth", 0)
+        current_seed_detected = seed.get("detected")
+
+        # Manejo de fallos en la petición
+        if not fetched or not fetched[1]:
+            logger.info("Falló fetch para %s", url)
+            self._queue_transition(url, "pending", None)
+            return False
+
+        r, body = fetched
+        body = SCRIPT_STYLE_RE.sub(b'', body)
+        # FILTRADO 1: Contenido pequeño. Si ni el cuerpo en bruto llega al mínimo de
+        # caracteres, el texto extraído tampoco: se descarta sin parsear.
+        tree = None
+        if len(body) >= self.min_text_chars:
+            # Bytes al parser; solo se fuerza la codificación si la cabecera declara charset
+            content_type = r.headers.get("Content-Type", "")
+            tree = parse_html(body, r.encoding if "charset" in content_type.lower() else None)
+        text = ""
+        if tree is not None:
+            # Comentarios, scripts y estilos no son texto visible (el sanitizador los quita igualmente)
+            etree.strip_elements(tree, etree.Comment, 'script', 'style', with_tail=False)
+            # Extraer texto y normalizar múltiples espacios (solo hasta lo que se va a guardar;
+            # max(...) para que el filtro de tamaño mínimo siga viendo lo suficiente)
+            text = extract_text(tree, max(self.max_text_chars, self.min_text_chars))
+        
+        if not text or len(text) < self.min_text_chars:
+            logger.info("Contenido pequeño, MARCANDO como 'discarded': %s (%d chars)", url, len(text))
+            self._discard(url, "too_short_content")
             
-            # FILTRADO 1: Contenido pequeño
-            if not text or len(text) < self.min_text_chars:
-                logging.info("Contenido pequeño, MARCANDO como 'discarded': %s (%d chars)", url, len(text))
-                self.mongo_db.mark_done(url, discard_reason="too_short_content")
-                
-                new_count = self.mongo_db.get_and_inc_processed_count()
-                if new_count >= self.max_pages_to_fetch: break 
-                time.sleep(self.sleep)
-                continue
+            return self.mongo_db.inc_processed() >= self.max_pages_to_fetch
 
-            # ---------------- EXTRACCIÓN Y PREPARACIÓN ----------------
-            safe_html = self.sanitize_html(html)
-            fname = hashlib.sha1(url.encode('utf-8')).hexdigest()[:16] + ".html"
+        # ---------------- EXTRACCIÓN Y PREPARACIÓN ----------------
+        # Un único parseo por página: título y enlaces se leen del árbol antes de
+        # sanitizarlo, porque sanitize_html lo modifica en el sitio.
+        
+        # Extracción de título más segura
+        title_el = tree.find('.//title')
+        title = (title_el.text or "").strip() if title_el is not None else ""
+
+        page_links = []
+        link_counts = Counter()  # apariciones de cada destino en esta página (se conserva el primer ancla)
+        base_host = host_of(url)
+        # Los enlaces relativos apuntan siempre al host de la página: se valida una sola vez
+        base_onion = base_host if base_host and ONION_RE.search(base_host) else None
+        for a in tree.iter('a'): 
+            href = a.get('href')
+            if href is None:
+                continue
+            if '.onion' not in href.lower():
+                # Sin ".onion" solo interesa si es relativo; los absolutos (clearnet, mailto:,
+                # javascript:...) se descartan sin urlsplit ni regex
+                if ABSOLUTE_HREF_RE.match(href):
+                    continue
+                host = base_onion
+            else:
+                # Solo interesa el host destino: un urlsplit por enlace, sin urljoin.
+                try:
+                    parts = urlsplit(href.strip())
+                except ValueError:  # p.ej. IPv6 mal formado
+                    continue
+                if parts.scheme or parts.netloc:
+                    host = parts.hostname
+                    if host and not ONION_RE.search(host):
+                        continue
+                else:
+                    host = base_onion
             
-            gridfs_ref = None
-            crawled = datetime.utcnow().isoformat()
-            try:
+            if host:
+                # Asegura que el link destino siempre termine en / si es solo el host
+                link = "http://" + host + "/"
+                link_counts[link] += 1
+                if link_counts[link] > 1:
+                    # Menús y pies repiten el mismo .onion: una sola seed y un solo enlace por destino
+                    # (las repeticiones viajan como "count")
+                    continue
+
+                if link == url:
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug("Self-link detected and skipped: %s", url)
+                    continue
+                anchor_text = "".join(t.strip() for t in a.itertext()) or (a.get('title') or "[enlace]")
+                page_links.append((link, anchor_text[:200]))
+
+        # Nombre de fichero estable por URL: mismo esquema (SHA-1, 16 hex) que los snapshots ya guardados
+        fname = hashlib.sha1(url.encode('utf-8')).hexdigest()[:16] + ".html"
+        # Huella del contenido: los mirrors de un mismo sitio comparten un único snapshot
+        content_hash = hashlib.blake2b(body, digest_size=16).hexdigest()
+        
+        gridfs_ref = None
+        # Una sola marca de tiempo por página: crawl_date, last_scraped y las seeds nuevas
+        now = datetime.now(timezone.utc)
+        # crawl_date conserva el formato ISO sin sufijo de zona (siempre UTC)
+        crawled = now.replace(tzinfo=None).isoformat()
+        try:
+            gridfs_ref = self._snapshot_for(content_hash)
+            if gridfs_ref:
+                logger.info("Contenido ya guardado en GridFS, reutilizando snapshot para %s. ID: %s", url, gridfs_ref)
+            else:
                 file_id = self.mongo_db.save_html_to_gridfs(
                     filename=fname, 
-                    content=safe_html, 
-                    metadata={"source_url": url, "crawl_date": crawled, "sha1": fname[:-5]}
+                    content=self.sanitize_html(tree), 
+                    metadata={"source_url": url, "crawl_date": crawled, "sha1": fname[:-5],
+                              "content_hash": content_hash}
                 )
                 gridfs_ref = str(file_id) 
-                logging.info("HTML guardado en GridFS para %s. ID: %s", url, gridfs_ref)
-            except Exception as e:
-                logging.warning("Error saving html %s : %s", url, e)
-                self.mongo_db.revert_to_pending(url)
-                continue
-            
-            
-            # Extracción de título más segura
-            title = ""
-            try:
-                if raw_soup.title and raw_soup.title.string:
-                    title = raw_soup.title.string.strip()
-            except Exception:
-                title = ""
-
-            # Extracción de enlaces y propagación de seeds
-            links_list = []
-            new_depth = current_page_depth + 1
+                self._remember_snapshot(content_hash, gridfs_ref)
+                logger.info("HTML guardado en GridFS para %s. ID: %s", url, gridfs_ref)
+        except Exception as e:
+            logger.warning("Error saving html %s : %s", url, e)
+            self._queue_transition(url, "pending", None)
+            return False
+        
+        # Propagación de seeds
+        links_list = []
+        new_depth = current_page_depth + 1
+        
+        for link, anchor_text in page_links:
+            if new_depth <= self.max_depth:
+                # Se envían en bloque junto al lote de Neo (ver _flush_batch)
+                self.mongo_db.queue_seed(link, detected=current_seed_detected, origin={"parent": url, "anchor": anchor_text}, depth=new_depth, now=now)
             
-            for a in raw_soup.find_all("a", href=True): 
-                href = a['href']
-                full_link = urljoin(url, href).split('#')[0]
-                
-                if self.onion_re.search(full_link):
-                    parsed_link = urlparse(full_link)
-                    # Asegura que el link destino siempre termine en / si es solo el host
-                    link = "http://" + (parsed_link.hostname or full_link) + "/"
-                    anchor_text = a.get_text(strip=True) or (a.get('title') or "[enlace]")
-
-                    if link == url:
-                        logging.debug("Self-link detected and skipped: %s", url)
-                        continue
+            links_list.append({
+                "dst_url": link,
+                "anchor": anchor_text,
+                "depth": current_page_depth,
+                "count": link_counts[link],
+                "dst_html_ref": gridfs_ref,
+                "crawl_date": crawled
+            })
 
-                    if new_depth <= self.max_depth:
-                        self.mongo_db.ensure_seed(link, detected=current_seed_detected, origin={"parent": url, "anchor": anchor_text[:200]}, depth=new_depth)
+        # Construcción del payload de términos
+        matched_terms = [{
+            "page_url": url,
+            "root": root,
+            "synonym": syn, 
+            "source": "ahmia",
+            "crawl_date": crawled
+        } for root, syn in matched_pairs]
                     
-                    links_list.append({
-                        "src_url": url,
-                        "dst_url": link,
-                        "anchor": anchor_text[:200],
-                        "depth": current_page_depth,
-                        "dst_html_ref": gridfs_ref,
-                        "crawl_date": crawled
-                    })
-
-            # Construcción del payload de términos
-            matched_terms = []
-            if current_seed_detected:
-                for d in current_seed_detected: 
-                    root = d.get("root", "")
-                    syns = d.get("synonyms", []) 
-                    for syn in syns:
-                        matched_terms.append({
-                            "page_url": url,
-                            "root": root,
-                            "synonym": syn, 
-                            "source": "ahmia",
-                            "crawl_date": crawled
-                        })
-                        
-            page_node = { 
-                "url": url,
-                "title": title,
-                "text": text[:10000],
-                "crawl_date": crawled,
-                "http_content_type": r.headers.get("Content-Type", ""),
-                "html_file_id": gridfs_ref, 
-            }
-        
-            payload = {
-                "page": page_node,
-                "links": links_list,
-                "matched_terms": matched_terms
-            }
-
-            # ---------------- POST a Neo4j ----------------
-            # FILTRADO 2: Sin términos coincidentes
-            if not matched_terms:
-                logging.warning("DIAGNÓSTICO: 'matched_terms' está vacío para %s. Saltando Neo4j, MARCANDO como 'discarded'.", url)
-                self.mongo_db.mark_done(url, discard_reason="no_matching_terms_propagated")
-                
-                new_count = self.mongo_db.get_and_inc_processed_count()
-                if new_count >= self.max_pages_to_fetch: break
-                time.sleep(self.sleep)
-                continue
-                
-            # ---------------- POST a Neo4j ----------------
-            # FILTRADO 2: Sin términos coincidentes
-            if not matched_terms:
-                logging.warning("DIAGNÓSTICO: 'matched_terms' está vacío para %s. Saltando Neo4j, MARCANDO como 'discarded'.", url)
-                self.mongo_db.mark_done(url, discard_reason="no_matching_terms_propagated")
-                
-                new_count = self.mongo_db.get_and_inc_processed_count()
-                if new_count >= self.max_pages_to_fetch: break
-                time.sleep(self.sleep)
-                continue
-                
-            # LLAMADA AL CONTROLADOR DE NEO (CLIENTE)
-            resp = self.neo_db.post_page_payload(payload) 
-            
-            if resp is None or resp.status_code != 200:
-                logging.warning("Neo ingest devolvió %s o falló -> reintentando más tarde", resp.status_code if resp else "No response")
-                self.mongo_db.revert_to_pending(url)
-                time.sleep(self.sleep)
-                continue
+        page_node = { 
+            "url": url,
+            "title": title,
+            "text": text[:self.max_text_chars],
+            "crawl_date": crawled,
+            "http_content_type": r.headers.get("Content-Type", ""),
+            "html_file_id": gridfs_ref, 
+        }
+    
+        payload = {
+            "page": page_node,
+            "links": links_list,
+            "matched_terms": matched_terms
+        }
+
+        # ---------------- POST a Neo4j ----------------
+        # Se acumula en el lote; la llamada al controlador de Neo (cliente) se hace al llenarse
+        # o cuando la primera página lleva más de batch_max_age segundos esperando (_maybe_flush_batch)
+        if not self._pending_batch:
+            self._batch_started = time.monotonic()
+        self._pending_batch[url] = (payload, {
+            "html_file_id": gridfs_ref, 
+            "title": title,
+            "last_scraped": now
+        })
+        logger.info("Seed procesada y encolada para Neo: %s (depth=%d)", url, current_page_depth)
+
+        return self._maybe_flush_batch(force=len(self._pending_batch) >= self.batch_size)
+
+    def _maybe_flush_batch(self, force=False):
+        """
+        Envía el lote pendiente si `force` (lleno) o si su primera página lleva más de
+        batch_max_age segundos esperando. Se llama también en cada ronda y tras cada fetch,
+        para que fallos o descartes seguidos no retengan el lote indefinidamente.
+        Devuelve True si con el envío se alcanza max_pages_to_fetch.
+        """
+        if not self._pending_batch:
+            return False
+        if not force and time.monotonic() - self._batch_started < self.batch_max_age:
+            return False
+        n_batch = len(self._pending_batch)
+        new_count = self._flush_batch()
+        if new_count is None:
+            return False
+        if new_count // 50 != (new_count - n_batch) // 50:
+            logger.info(f"--- Páginas completadas (Neo OK) hasta ahora: {new_count} ---")
+        return new_count >= self.max_pages_to_fetch
 
-            # Si la ingesta es 200 OK:
-            logging.info("Ingestado en Neo: %s", url)
-            self.mongo_db.mark_done(url, {
-                "html_file_id": gridfs_ref, 
-                "title": title,
-                "updated_at": datetime.utcnow(),
-                "last_scraped": datetime.utcnow()
-            })
-            
-            new_count = self.mongo_db.get_and_inc_processed_count()
+    def start_crawling(self):
+        """Bucle principal del crawler."""
+        
+        logger.info("Resetting stale in_progress seeds older than %d minutes...", RESET_INPROGRESS_OLDER_MIN)
+        self.mongo_db.reset_stale_inprogress()
 
-            if new_count >= self.max_pages_to_fetch: break 
-            
-            if new_count % 50 == 0:
-                logging.info(f"--- Páginas completadas (Neo OK) hasta ahora: {new_count} ---")
+        try:
+            while self.running:
             
-            logging.info("Seed procesada y marcada ingested: %s (depth=%d)", url, current_page_depth)
-            time.sleep(self.sleep)
-
-        logging.info("Worker terminado. Processed=%d", self.mongo_db.get_current_processed_count())
-        self.mongo_db.close()
+                # 0. Lote con páginas esperando demasiado (aunque esta ronda no añada ninguna)
+                self._maybe_flush_batch()
+
+                # 1. Chequeo del límite (con el valor ya conocido: sin lectura de stats por ronda)
+                current_count = self.mongo_db.processed_estimate() 
+                if current_count >= self.max_pages_to_fetch:
+                     logger.warning(f"Límite de {self.max_pages_to_fetch} páginas alcanzado ({current_count}). DETENIENDO CRAWLER.")
+                     break 
+
+                work, popped = self._claim_seeds()
+                if not popped:
+                    # Sin trabajo: enviar lo acumulado (puede contener las próximas seeds)
+                    self._flush_batch()
+                    logger.info("No pending seeds. Esperando %s s...", self.sleep)
+                    time.sleep(self.sleep)
+                    continue
+                if not work:
+                    # Todas resueltas sin fetch: no hace falta la pausa entre fetches
+                    continue
+
+                # ---------------- FASE DE FETCH Y FILTRADO ----------------
+                # Las descargas por Tor (segundos cada una) van en paralelo; el parseo, la
+                # sanitización y las escrituras siguen en este hilo, en el orden de las seeds.
+                fetches = [self._fetch_pool.submit(self.fetch_via_tor, seed.get("url")) for seed, _ in work]
+                limit_reached = False
+                for i, ((seed, matched_pairs), future) in enumerate(zip(work, fetches)):
+                    # Tras cada fetch, sea cual sea el resultado: tope de espera del lote
+                    if self._process_page(seed, matched_pairs, future.result()) or self._maybe_flush_batch():
+                        # Las descargas restantes de la ronda vuelven a la cola
+                        limit_reached = True
+                        self.mongo_db.revert_many_to_pending([s.get("url") for s, _ in work[i + 1:]])
+                        break
+                if limit_reached:
+                    break
+        finally:
+            # Parada (límite, SIGINT, fin o excepción): no dejar cambios de estado ni páginas
+            # sin enviar; si no, quedarían 'in_progress' hasta el próximo reset_stale_inprogress
+            self._flush_transitions()
+            self._flush_batch()
+            self._fetch_pool.shutdown(wait=True)
+            logger.info("Worker terminado. Processed=%d", self.mongo_db.flush_counter())
+            self.session.close()
+            self.neo_db.close()
+            self.mongo_db.close()
 
 # ---------------- PUNTO DE ENTRADA ----------------
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s [%(name)s] %(message)s")
     try:
-        logging.info("Iniciando Tor worker.")
+        logger.info("Iniciando Tor worker.")
         # Creamos la instancia de la clase TorController, que inicia el servidor Neo4j en un hilo
         crawler = TorController() 
         # Ejecutamos el método principal (el bucle de crawling)
         crawler.start_crawling() 
     except Exception as e:
-        logging.exception("Error inesperado en worker: %s", e)
+        logger.exception("Error inesperado en worker: %s", e)
     finally:
-        logging.info("Worker finalizado.")
\ No newline at end of file
+        logger.info("Worker finalizado.")
\ No newline at end of file
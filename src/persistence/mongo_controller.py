@@ -1,12 +1,18 @@
 import os
+import atexit
+import functools
 import logging
-import json
 import sys
-from datetime import datetime, timedelta
-from urllib.parse import urlparse
+import time
+import zlib
+import ijson
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit
+from uuid import uuid4
 
-from pymongo import MongoClient, ReturnDocument, UpdateOne
-from pymongo.errors import ConnectionFailure, BulkWriteError
+from pymongo import MongoClient, ReturnDocument, UpdateOne, WriteConcern
+from pymongo.errors import ConnectionFailure, BulkWriteError, OperationFailure
 from gridfs import GridFS
 
 # --- CONFIGURACIÓN (Variables de Módulo) ---
@@ -16,8 +22,55 @@ DBNAME = os.getenv("DBNAME", "darkweb_tfg")
 SEEDS_COLL = os.getenv("SEEDS_COLL", "seeds")
 STATS_COLL = os.getenv("STATS_COLL", "crawler_stats") 
 RESET_INPROGRESS_OLDER_MIN = int(os.getenv("RESET_INPROGRESS_OLDER_MIN", "60"))
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "1000"))
+# El contador global se actualiza cada COUNTER_FLUSH_EVERY páginas o COUNTER_FLUSH_SECS segundos
+COUNTER_FLUSH_EVERY = int(os.getenv("COUNTER_FLUSH_EVERY", "100"))
+COUNTER_FLUSH_SECS = float(os.getenv("COUNTER_FLUSH_SECS", "5"))
+# Nº de particiones de la cola de seeds. Con varios workers concurrentes, cada pop empieza por
+# una partición distinta y no compiten todos por la misma primera seed del índice. 1 = desactivado.
+SEED_SHARDS = max(1, int(os.getenv("SEED_SHARDS", "1")))
+MONGO_MAX_POOL = int(os.getenv("MONGO_MAX_POOL", "50"))
+MONGO_MIN_POOL = int(os.getenv("MONGO_MIN_POOL", "5"))
+# Compresión del protocolo: se negocia con el servidor en este orden (zstd requiere zstandard)
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "zstd,zlib")
+# Upserts de enlaces descubiertos sin confirmación (w=0): no se espera la respuesta del
+# servidor. Perder alguno solo retrasa el descubrimiento de esa seed. 0 = desactivado.
+SEED_UNACK_WRITES = os.getenv("SEED_UNACK_WRITES", "0") == "1"
+# Modo de carga del archivo de seeds: "upsert" (UpdateOne por seed) o "merge" (colección de
+# staging + $merge en el servidor; solo toca las seeds cuyo `detected` ha cambiado)
+SEED_LOAD_MODE = os.getenv("SEED_LOAD_MODE", "upsert")
 
-logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s [MONGO] %(message)s")
+logger = logging.getLogger(__name__)
+
+# Campos de una seed que necesita el crawler al procesarla (proyección de pop_next_seed)
+SEED_WORK_FIELDS = {"_id": 0, "url": 1, "attempts": 1, "depth": 1, "detected": 1}
+
+def _shard_of(url):
+    """Partición estable de una URL (crc32, igual en todos los procesos)."""
+    return zlib.crc32(url.encode("utf-8")) % SEED_SHARDS
+
+@functools.lru_cache(maxsize=1 << 16)
+def host_of(url):
+    """Host de una URL (cacheado: los enlaces descubiertos repiten mucho los mismos .onion)."""
+    return urlsplit(url).hostname or url
+
+# Cliente compartido por todas las instancias del proceso (un solo pool de conexiones)
+_CLIENT = None
+
+def _get_client():
+    """Devuelve el MongoClient del módulo, creándolo la primera vez."""
+    global _CLIENT
+    if _CLIENT is None:
+        _CLIENT = MongoClient(
+            MONGO_URI,
+            maxPoolSize=MONGO_MAX_POOL,
+            minPoolSize=MONGO_MIN_POOL,
+            waitQueueTimeoutMS=5000,
+            retryWrites=True,
+            compressors=MONGO_COMPRESSORS
+        )
+        atexit.register(_CLIENT.close)
+    return _CLIENT
 
 class MongoController:
     """
@@ -26,46 +79,119 @@ class MongoController:
     """
     def __init__(self):
         # 1. Configuración de la conexión
-        self.client = MongoClient(MONGO_URI)
+        self.client = _get_client()
         self.db = self.client[DBNAME]
         self.seeds_col = self.db[SEEDS_COLL]
+        # Colección para los upserts de enlaces descubiertos (ver SEED_UNACK_WRITES)
+        self.seeds_col_links = (self.seeds_col.with_options(write_concern=WriteConcern(w=0))
+                                if SEED_UNACK_WRITES else self.seeds_col)
         self.stats_col = self.db[STATS_COLL]
         self.fs = GridFS(self.db)
-        logging.info("Conexión a MongoDB establecida.")
+        self._pending_seed_ops = []  # upserts de seeds encolados con queue_seed()
+        # Contador local de páginas procesadas (ver inc_processed)
+        self._pending_inc = 0
+        self._last_count = None
+        self._last_counter_flush = time.monotonic()
+        self._shard_cursor = os.getpid() % SEED_SHARDS  # partición por la que empieza el próximo pop
+        logger.info("Conexión a MongoDB establecida.")
+        self._ensure_indexes()
+
+    def _ensure_indexes(self):
+        """Crea (si no existen) los índices de la colección de seeds. Es idempotente."""
+        try:
+            # Todas las escrituras sobre seeds filtran por url: cada upsert pasa a ser una búsqueda en el índice
+            self.seeds_col.create_index("url", unique=True, name="url_unique")
+        except OperationFailure as e:
+            logger.warning("No se pudo crear el índice único sobre 'url' (¿URLs duplicadas?): %s", e)
+
+        # pop_next_seed: filtro por status + orden (depth, priority desc, created_at) resuelto en el índice
+        self.seeds_col.create_index(
+            [("status", 1), ("depth", 1), ("priority", -1), ("created_at", 1)], name="pop_queue")
+        # reset_stale_inprogress: status + last_try
+        self.seeds_col.create_index([("status", 1), ("last_try", 1)], name="stale_reset")
+        # Reutilización de snapshots idénticos (find_html_by_content_hash); sparse: los antiguos no la tienen
+        self.db["fs.files"].create_index("metadata.content_hash", name="content_hash", sparse=True)
+        if SEED_SHARDS > 1:
+            self.seeds_col.create_index(
+                [("shard", 1), ("status", 1), ("depth", 1), ("priority", -1), ("created_at", 1)], name="pop_queue_shard")
 
     def close(self):
-        """Cierra la conexión de MongoDB."""
-        self.client.close()
-        logging.info("Conexión a MongoDB cerrada.")
+        """
+        Vuelca las seeds y el contador pendientes. El cliente es compartido por el proceso:
+        no se cierra aquí sino al salir (atexit).
+        """
+        self.flush_seeds()
+        self.flush_counter()
+        logger.info("MongoController cerrado (pendientes volcados).")
 
     # --- Métodos de Estadísticas (Counter) ---
     
     def save_html_to_gridfs(self, filename, content, metadata=None):
-        """Guarda el contenido HTML en GridFS y devuelve el ID del archivo."""
-        # GridFS necesita bytes. El contenido es seguro (sanitizado) y se codifica a UTF-8.
+        """Guarda el contenido HTML (bytes UTF-8 o str) en GridFS y devuelve el ID del archivo."""
+        # GridFS necesita bytes. El contenido es seguro (sanitizado); si llega como str se codifica a UTF-8.
+        if isinstance(content, str):
+            content = content.encode('utf-8')
         file_id = self.fs.put(
-            content.encode('utf-8'), 
+            content, 
             filename=filename,
             encoding='utf-8',
             contentType='text/html; charset=utf-8',
             metadata=metadata
         )
-        logging.debug("HTML guardado en GridFS con ID: %s", str(file_id))
+        logger.debug("HTML guardado en GridFS con ID: %s", file_id)
         return file_id
+
+    def find_html_by_content_hash(self, content_hash):
+        """Devuelve el ID del fichero GridFS con esa huella de contenido (metadata.content_hash) o None."""
+        doc = self.db["fs.files"].find_one({"metadata.content_hash": content_hash}, {"_id": 1})
+        return doc["_id"] if doc else None
     
-    def get_and_inc_processed_count(self):
-        """Incrementa el contador global en MongoDB de forma atómica y devuelve el nuevo valor."""
+    def get_and_inc_processed_count(self, n=1):
+        """Incrementa el contador global en n de forma atómica y devuelve el nuevo valor."""
         doc = self.stats_col.find_one_and_update(
             {"_id": "processed_pages_counter"},
-            {"$inc": {"count": 1}, "$set": {"updated_at": datetime.utcnow()}},
+            {"$inc": {"count": n}, "$set": {"updated_at": datetime.now(timezone.utc)}},
             upsert=True,
-            return_document=ReturnDocument.AFTER
+            return_document=ReturnDocument.AFTER,
+            projection={"count": 1, "_id": 0}
         )
         return doc['count']
 
+    def inc_processed(self, n=1):
+        """
+        Suma n páginas procesadas en local y solo escribe el $inc acumulado en MongoDB cada
+        COUNTER_FLUSH_EVERY páginas o COUNTER_FLUSH_SECS segundos. Devuelve el valor estimado
+        del contador (último valor global conocido + incrementos aún no enviados).
+        """
+        self._pending_inc += n
+        if (self._last_count is None or self._pending_inc >= COUNTER_FLUSH_EVERY
+                or time.monotonic() - self._last_counter_flush >= COUNTER_FLUSH_SECS):
+            return self.flush_counter()
+        return self._last_count + self._pending_inc
+
+    def flush_counter(self):
+        """Envía el incremento pendiente del contador y devuelve su nuevo valor global."""
+        self._last_counter_flush = time.monotonic()
+        if self._pending_inc:
+            self._last_count = self.get_and_inc_processed_count(self._pending_inc)
+            self._pending_inc = 0
+        elif self._last_count is None:
+            self._last_count = self.get_current_processed_count()
+        return self._last_count
+
+    def processed_estimate(self):
+        """
+        Valor estimado del contador sin ir a MongoDB (último valor global conocido + incrementos
+        locales pendientes). Solo consulta la primera vez; los avances de otros workers se ven
+        en cada flush_counter().
+        """
+        if self._last_count is None:
+            return self.flush_counter()
+        return self._last_count + self._pending_inc
+
     def get_current_processed_count(self):
         """Obtiene el valor actual del contador de páginas procesadas."""
-        doc = self.stats_col.find_one({"_id": "processed_pages_counter"})
+        doc = self.stats_col.find_one({"_id": "processed_pages_counter"}, {"count": 1, "_id": 0})
         return doc.get('count', 0) if doc else 0
 
     # --- Métodos de Semillas (Seeds) ---
@@ -73,32 +199,49 @@ class MongoController:
     def reset_stale_inprogress(self):
         """Pone a pending las seeds 'in_progress' que fueron empezadas hace mucho."""
         # Usa la variable de MÓDULO definida arriba
-        threshold = datetime.utcnow() - timedelta(minutes=RESET_INPROGRESS_OLDER_MIN)
+        threshold = datetime.now(timezone.utc) - timedelta(minutes=RESET_INPROGRESS_OLDER_MIN)
         res = self.seeds_col.update_many(
             {"status": "in_progress", "last_try": {"$lt": threshold}},
             {"$set": {"status": "pending"}}
         )
         if res.modified_count:
-            logging.info("Reset %d stale in_progress -> pending", res.modified_count)
+            logger.info("Reset %d stale in_progress -> pending", res.modified_count)
 
     def pop_next_seed(self):
         """Obtiene una seed pendiente y la marca in_progress."""
+        upd = {"$set": {"status": "in_progress", "last_try": datetime.now(timezone.utc)}, "$inc": {"attempts": 1}}
+        sort = [("depth", 1), ("priority", -1), ("created_at", 1)]
+
+        if SEED_SHARDS > 1:
+            # Recorre las particiones empezando por la siguiente en turno
+            start = self._shard_cursor
+            self._shard_cursor = (start + 1) % SEED_SHARDS
+            for i in range(SEED_SHARDS):
+                doc = self.seeds_col.find_one_and_update(
+                    {"status": "pending", "shard": (start + i) % SEED_SHARDS}, upd,
+                    sort=sort, return_document=ReturnDocument.AFTER, projection=SEED_WORK_FIELDS
+                )
+                if doc:
+                    return doc
+            # Seeds anteriores a activar las particiones (sin campo shard)
+
         doc = self.seeds_col.find_one_and_update(
             {"status": "pending"},
-            {"$set": {"status": "in_progress", "last_try": datetime.utcnow()}, "$inc": {"attempts": 1}},
-            sort=[("depth", 1), ("priority", -1), ("created_at", 1)],
-            return_document=ReturnDocument.AFTER
+            upd,
+            sort=sort,
+            return_document=ReturnDocument.AFTER,
+            projection=SEED_WORK_FIELDS
         )
         return doc
 
     def mark_done(self, url, update_fields=None, discard_reason=None):
         """Marca la URL como 'ingested' o 'discarded'. Preserva el registro."""
-        upd = {"$set": {"updated_at": datetime.utcnow()}}
+        upd = {"$set": {"updated_at": datetime.now(timezone.utc)}}
         
         if discard_reason:
             upd["$set"]["status"] = "discarded"
             upd["$set"]["discard_reason"] = discard_reason
-            logging.info("URL %s MARCADA como 'discarded' (Razón: %s).", url, discard_reason)
+            logger.info("URL %s MARCADA como 'discarded' (Razón: %s).", url, discard_reason)
         else:
             upd["$set"]["status"] = "ingested"
         
@@ -107,25 +250,48 @@ class MongoController:
             
         self.seeds_col.update_one({"url": url}, upd)
 
+    def bulk_transition(self, transitions):
+        """
+        Aplica varias transiciones de estado en bulk_write no ordenados (por bloques).
+        transitions: lista de tuplas (url, nuevo_estado, campos_extra o None).
+        """
+        if not transitions:
+            return
+        now = datetime.now(timezone.utc)
+        ops = [
+            UpdateOne({"url": url}, {"$set": {"status": state, "updated_at": now, **(extra or {})}})
+            for url, state, extra in transitions
+        ]
+        for i in range(0, len(ops), BULK_BATCH_SIZE):
+            self.seeds_col.bulk_write(ops[i:i + BULK_BATCH_SIZE], ordered=False)
+
     def mark_failed(self, url, reason=None):
         """Marca la URL como fallida (alcanzó el máx. de reintentos)."""
         self.seeds_col.update_one(
             {"url": url}, 
-            {"$set": {"status": "failed_perm", "failed_reason": reason, "updated_at": datetime.utcnow()}}
+            {"$set": {"status": "failed_perm", "failed_reason": reason, "updated_at": datetime.now(timezone.utc)}}
         )
-        logging.info("Semilla %s MARCADA como 'failed_perm' (Razón: %s).", url, reason)
+        logger.info("Semilla %s MARCADA como 'failed_perm' (Razón: %s).", url, reason)
 
     def revert_to_pending(self, url):
         """Revierte una seed de 'in_progress' a 'pending' para reintento."""
         self.seeds_col.update_one(
             {"url": url}, 
-            {"$set": {"status": "pending", "updated_at": datetime.utcnow()}}
+            {"$set": {"status": "pending", "updated_at": datetime.now(timezone.utc)}}
         )
 
-    def ensure_seed(self, url, detected=None, origin=None, depth=0):
-        """Inserta una nueva seed si no existe, incluyendo la profundidad."""
-        host = urlparse(url).hostname or url
-        now = datetime.utcnow()
+    def revert_many_to_pending(self, urls):
+        """Revierte varias seeds a 'pending' con un solo update_many."""
+        if not urls:
+            return
+        self.seeds_col.update_many(
+            {"url": {"$in": list(urls)}}, 
+            {"$set": {"status": "pending", "updated_at": datetime.now(timezone.utc)}}
+        )
+
+    def _ensure_seed_update(self, url, detected, origin, depth, now):
+        """Filtro y update del upsert de una seed descubierta (solo inserta si no existe)."""
+        host = host_of(url)
         doc = {
             "host": host,
             "url": url,
@@ -137,13 +303,169 @@ class MongoController:
             "updated_at": now,
             "depth": depth 
         }
+        if SEED_SHARDS > 1:
+            doc["shard"] = _shard_of(url)
+        upd = {"$setOnInsert": doc}
         if origin:
-            self.seeds_col.update_one({"url": url}, {"$addToSet": {"origins": origin}, "$setOnInsert": doc}, upsert=True)
-        else:
+            upd["$addToSet"] = {"origins": origin}
+        return {"url": url}, upd
+
+    def _bulk_write_seed_ops(self, ops):
+        """Envía upserts de seeds en bloques de BULK_BATCH_SIZE (no ordenados)."""
+        for i in range(0, len(ops), BULK_BATCH_SIZE):
             try:
-                self.seeds_col.update_one({"url": url}, {"$setOnInsert": doc}, upsert=True)
-            except Exception as e:
-                logging.debug("ensure_seed upsert error: %s", e)
+                self.seeds_col_links.bulk_write(ops[i:i + BULK_BATCH_SIZE], ordered=False)
+            except BulkWriteError as bwe:
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Errores en upsert de seeds: %s", bwe.details.get("writeErrors", [])[:3])
+
+    def queue_seed(self, url, detected=None, origin=None, depth=0, now=None):
+        """
+        Encola el upsert de una seed para enviarlo junto a otros. Se vuelca solo al llegar
+        a BULK_BATCH_SIZE; el resto, con flush_seeds() (también lo llama close()).
+        `now` permite compartir una misma marca de tiempo entre todas las seeds de una página.
+        """
+        self._pending_seed_ops.append(
+            UpdateOne(*self._ensure_seed_update(url, detected, origin, depth, now or datetime.now(timezone.utc)), upsert=True))
+        if len(self._pending_seed_ops) >= BULK_BATCH_SIZE:
+            self.flush_seeds()
+
+    def flush_seeds(self):
+        """Envía a Mongo los upserts de seeds encolados."""
+        if not self._pending_seed_ops:
+            return
+        ops, self._pending_seed_ops = self._pending_seed_ops, []
+        self._bulk_write_seed_ops(ops)
+
+    def _seed_upsert_op(self, url, seed, now, insert_defaults):
+        """Construye el UpdateOne (upsert) de una semilla del archivo de Ahmia."""
+        on_insert = {"url": url, "host": seed.get("host"), **insert_defaults}
+        if SEED_SHARDS > 1:
+            on_insert["shard"] = _shard_of(url)
+        return UpdateOne({"url": url}, {
+            # Campos que solo se escriben si el documento es NUEVO ($setOnInsert)
+            "$setOnInsert": on_insert,
+            # Campos que se actualizan siempre
+            "$set": {
+                "detected": seed.get("detected", []),
+                "status": "pending",
+                "updated_at": now
+            }
+        }, upsert=True)
+
+    @staticmethod
+    def _seed_insert_defaults(now):
+        """Campos constantes de los documentos nuevos: se construyen una vez por carga."""
+        return {
+            "created_at": now,
+            "last_scraped": None,
+            "scrape_attempts": 0,
+            "attempts": 0,
+            "priority": 0,
+            "depth": 0,
+        }
+
+    def _upsert_seed_items(self, items):
+        """
+        Upserta semillas con el formato de seeds_with_terms.json ({host, url, detected})
+        en bloques de BULK_BATCH_SIZE. Devuelve (preparadas, insertadas, matched).
+        """
+        ops = []
+        prepared = upserted = matched = 0
+        now = datetime.now(timezone.utc)
+        insert_defaults = self._seed_insert_defaults(now)
+        for s in items:
+            url = s.get("url")
+            if not url:
+                logger.warning("Semilla sin URL válida encontrada, omitiendo: %s", s)
+                continue
+            
+            ops.append(self._seed_upsert_op(url, s, now, insert_defaults))
+            prepared += 1
+
+            if len(ops) >= BULK_BATCH_SIZE:
+                res = self.seeds_col.bulk_write(ops, ordered=False)
+                upserted += res.upserted_count
+                matched += res.matched_count
+                ops.clear()
+
+        if ops:
+            res = self.seeds_col.bulk_write(ops, ordered=False)
+            upserted += res.upserted_count
+            matched += res.matched_count
+        return prepared, upserted, matched
+
+    def _merge_seed_items(self, items):
+        """
+        Variante de _upsert_seed_items para SEED_LOAD_MODE=merge: inserta las semillas en una
+        colección de staging y las fusiona con un único $merge en el servidor. Las seeds
+        existentes solo se modifican (detected, status=pending) si su `detected` ha cambiado.
+        Devuelve el número de semillas preparadas.
+        """
+        # Nombre único por llamada: dos cargas simultáneas (o Ahmia durante una carga de
+        # fichero) no se borran el staging una a otra
+        stage = self.db[f"{SEEDS_COLL}_stage_{os.getpid()}_{uuid4().hex[:8]}"]
+        try:
+            return self._merge_via_stage(stage, items)
+        finally:
+            stage.drop()
+
+    def _merge_via_stage(self, stage, items):
+        """Rellena la colección de staging `stage` con `items` y la fusiona con $merge."""
+        now = datetime.now(timezone.utc)
+        insert_defaults = self._seed_insert_defaults(now)
+        batch = []
+        prepared = 0
+        for s in items:
+            url = s.get("url")
+            if not url:
+                logger.warning("Semilla sin URL válida encontrada, omitiendo: %s", s)
+                continue
+            doc = {"url": url, "host": s.get("host"), **insert_defaults,
+                   "detected": s.get("detected", []), "status": "pending", "updated_at": now}
+            if SEED_SHARDS > 1:
+                doc["shard"] = _shard_of(url)
+            batch.append(doc)
+            prepared += 1
+            if len(batch) >= BULK_BATCH_SIZE:
+                stage.insert_many(batch, ordered=False)
+                batch = []
+        if batch:
+            stage.insert_many(batch, ordered=False)
+        if not prepared:
+            return 0
+
+        # $merge sobre el índice único de url; las seeds sin cambios se dejan tal cual
+        stage.aggregate([
+            {"$unset": "_id"},
+            {"$merge": {
+                "into": SEEDS_COLL,
+                "on": "url",
+                "whenMatched": [{"$replaceWith": {"$cond": [
+                    {"$eq": ["$detected", "$$new.detected"]},
+                    "$$ROOT",
+                    {"$mergeObjects": ["$$ROOT", {"detected": "$$new.detected", "status": "pending", "updated_at": "$$new.updated_at"}]}
+                ]}}],
+                "whenNotMatched": "insert"
+            }}
+        ])
+        return prepared
+
+    def load_seeds(self, seeds):
+        """
+        Carga en la colección de seeds una lista de semillas ya en memoria (mismo formato que
+        el archivo de Ahmia), sin pasar por disco. Retorna insertados + matched.
+        """
+        try:
+            prepared, upserted, matched = self._upsert_seed_items(seeds)
+        except BulkWriteError as e:
+            logger.error("Falló la operación bulk_write (parcial): %s", e.details)
+            return 0
+        except Exception as e:
+            logger.error("Falló la operación bulk_write (general): %s", e)
+            return 0
+        logger.info("Seeds cargadas desde memoria: %d insertadas, %d actualizadas.", upserted, matched)
+        return upserted + matched
 
     def load_seeds_bulk(self, file_path):
             """
@@ -153,76 +475,62 @@ class MongoController:
             Retorna el número total de documentos procesados (insertados + matched).
             """
             if not os.path.exists(file_path):
-                logging.error("No encontrado %s", file_path)
+                logger.error("No encontrado %s", file_path)
                 print("[HINT] Asegúrate de que el archivo de semillas esté en la ruta correcta.")
                 return 0 
 
-            logging.info("Cargando datos de %s...", file_path)
-            try:
-                with open(file_path, encoding='utf-8') as f:
-                    seeds = json.load(f)
-            except json.JSONDecodeError:
-                logging.error("El archivo %s no es un JSON válido.", file_path)
-                return 0
+            logger.info("Cargando datos de %s...", file_path)
 
-            ops = []
-            now = datetime.utcnow()
-            for s in seeds:
-                url = s.get("url")
-                if not url:
-                    logging.warning("Semilla sin URL válida encontrada, omitiendo: %s", s)
-                    continue
-                
-                filter_query = {"url": url}
-                
-                doc_operations = {
-                    # Campos que solo se escriben si el documento es NUEVO ($setOnInsert)
-                    "$setOnInsert": {
-                        "url": url,
-                        "host": s.get("host"),
-                        "created_at": now,
-                        "last_scraped": None,
-                        "scrape_attempts": 0,
-                        "attempts": 0,          
-                        "priority": 0,          
-                        "depth": 0              
-                    },
-                    # Campos que se actualizan siempre
-                    "$set": {
-                        "detected": s.get("detected", []),
-                        "status": "pending",        
-                        "updated_at": now
-                    }
-                }
-                
-                ops.append(UpdateOne(filter_query, doc_operations, upsert=True))
-            
-            if not ops:
-                logging.info("No se prepararon operaciones. El archivo de semillas podría estar vacío.")
-                return 0
-
-            logging.info("Preparadas %d operaciones de carga/actualización.", len(ops))
-            
             try:
-                res = self.seeds_col.bulk_write(ops, ordered=False)
-                
-                print("\n--- Resultado de Bulk Write ---")
-                print(f"Documentos Insertados: {res.upserted_count}")
-                print(f"Documentos Actualizados (matched): {res.matched_count}") 
-                print("------------------------------\n")
-                return res.upserted_count + res.matched_count
+                # Lectura en streaming: solo un lote de operaciones vive en memoria a la vez
+                with open(file_path, "rb") as f:
+                    if SEED_LOAD_MODE == "merge":
+                        prepared = self._merge_seed_items(ijson.items(f, "item", use_float=True))
+                    else:
+                        prepared, upserted, matched = self._upsert_seed_items(ijson.items(f, "item", use_float=True))
                 
+            except ijson.JSONError:
+                logger.error("El archivo %s no es un JSON válido.", file_path)
+                return 0
             except BulkWriteError as e:
-                logging.error("Falló la operación bulk_write (parcial): %s", e.details)
+                logger.error("Falló la operación bulk_write (parcial): %s", e.details)
                 return 0
             except Exception as e:
-                logging.error("Falló la operación bulk_write (general): %s", e)
+                logger.error("Falló la operación bulk_write (general): %s", e)
+                return 0
+
+            if not prepared:
+                logger.info("No se prepararon operaciones. El archivo de semillas podría estar vacío.")
                 return 0
+
+            logger.info("Procesadas %d operaciones de carga/actualización.", prepared)
+            if SEED_LOAD_MODE == "merge":
+                # $merge no devuelve recuentos de insertados/modificados
+                print(f"\n--- Resultado de $merge: {prepared} semillas fusionadas ---\n")
+                return prepared
+            print("\n--- Resultado de Bulk Write ---")
+            print(f"Documentos Insertados: {upserted}")
+            print(f"Documentos Actualizados (matched): {matched}") 
+            print("------------------------------\n")
+            return upserted + matched
         
 
+@contextmanager
+def mongo_session():
+    """
+    MongoController para scripts cortos (`with mongo_session() as mc:`). Al salir vuelca
+    seeds y contador pendientes; el cliente compartido del proceso sigue abierto.
+    """
+    mc = MongoController()
+    try:
+        yield mc
+    finally:
+        mc.close()
+
+
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s [%(name)s] %(message)s")
     # Esto es solo para probar el controlador de forma aislada, no se ejecuta en el flujo normal
-    mc = MongoController()
-    print(f"Contador actual: {mc.get_current_processed_count()}")
-    mc.reset_stale_inprogress()
-    mc.close()
\ No newline at end of file
+    with mongo_session() as mc:
+        print(f"Contador actual: {mc.get_current_processed_count()}")
+        mc.reset_stale_inprogress()
\ No newline at end of file
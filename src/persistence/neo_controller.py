@@ -3,17 +3,21 @@ import os
 import logging
 import requests
 import time
+import orjson
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from requests.exceptions import RequestException
 from .neo_ingest_server import NeoIngestServer 
 
 # ----------------- CONFIGURACIÓN GLOBAL -----------------
 # Neo Controller (Cliente) Config
 NEO_INGEST_URL = os.getenv("NEO_INGEST_URL", "http://127.0.0.1:9000/ingest_page")
+NEO_INGEST_BATCH_URL = os.getenv("NEO_INGEST_BATCH_URL", "http://127.0.0.1:9000/ingest_pages")
 NEO_INGEST_SECRET = os.getenv("NEO_INGEST_SECRET", "changeme")
+NEO_INGEST_BULK_URL = os.getenv("NEO_INGEST_BULK_URL", "http://127.0.0.1:9000/bulk_ingest")
+NEO_INGEST_HEALTH_URL = os.getenv("NEO_INGEST_HEALTH_URL", "http://127.0.0.1:9000/health")
 
-# Configuración de Logging
-logging.basicConfig(level=logging.INFO, 
-                    format="%(asctime)s %(levelname)s [NEO] %(message)s")
+logger = logging.getLogger(__name__)
 
 # --------------------------------------------------------
 #               2. NeoController (Cliente)
@@ -29,8 +33,24 @@ class NeoController:
         Inicializa el controlador con la URL y el secreto de la API de ingesta.
         """
         self.ingest_url = NEO_INGEST_URL
+        self.batch_url = NEO_INGEST_BATCH_URL
+        self.health_url = NEO_INGEST_HEALTH_URL
+        self.bulk_url = NEO_INGEST_BULK_URL
         self.secret = NEO_INGEST_SECRET
-        logging.info("NeoController (cliente) inicializado.")
+        # Sesión persistente: evita abrir una conexión TCP nueva por cada página ingestada.
+        # Los reintentos con backoff cubren el arranque del servidor: solo errores de conexión y
+        # 503 (petición no procesada). Un 502/504 o un corte de lectura pueden llegar con la
+        # escritura ya confirmada en Neo4j, así que no se reenvía el POST automáticamente.
+        self.session = requests.Session()
+        # Cabeceras comunes a todas las peticiones: se fijan una vez en la sesión.
+        # Los cuerpos se serializan con orjson (bytes) en lugar del json= de requests.
+        self.session.headers.update({"X-API-KEY": self.secret, "Content-Type": "application/json"})
+        retry = Retry(total=3, connect=3, read=0, backoff_factor=0.2, status_forcelist=[503],
+                      allowed_methods=["POST"], raise_on_status=False)
+        adapter = HTTPAdapter(pool_maxsize=32, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        logger.info("NeoController (cliente) inicializado.")
 
     def post_page_payload(self, payload):
         """
@@ -42,46 +62,109 @@ class NeoController:
         Returns:
             requests.Response o None: El objeto respuesta si tiene éxito, o None si falla.
         """
-        headers = {"X-API-KEY": self.secret, "Content-Type": "application/json"}
         try:
             # Realiza la llamada POST a la API de ingesta
-            resp = requests.post(self.ingest_url, json=payload, headers=headers, timeout=30)
+            resp = self.session.post(self.ingest_url, data=orjson.dumps(payload), timeout=30)
             
             # Si el estado es 2xx, el POST fue exitoso.
             if resp.status_code >= 200 and resp.status_code < 300:
-                logging.info("Ingesta de %s exitosa. Status: %d", payload["page"].get("url", "N/A"), resp.status_code)
+                logger.info("Ingesta de %s exitosa. Status: %d", payload["page"].get("url", "N/A"), resp.status_code)
             else:
-                logging.warning("Ingesta de %s fallida. Status: %d. Respuesta: %s", payload["page"].get("url", "N/A"), resp.status_code, resp.text)
+                logger.warning("Ingesta de %s fallida. Status: %d. Respuesta: %s", payload["page"].get("url", "N/A"), resp.status_code, resp.text)
             
             return resp
             
         except RequestException:
-            logging.exception("Error POST a neo_ingest (red/timeout). Revisar si el servidor está activo.", exc_info=False) 
+            logger.exception("Error POST a neo_ingest (red/timeout). Revisar si el servidor está activo.", exc_info=False) 
             return None
 
+    def post_pages_payload(self, payloads):
+        """
+        Envía varias páginas en un único POST al endpoint de ingesta por lotes.
+
+        Args:
+            payloads (list[dict]): Payloads con el mismo formato que post_page_payload.
+
+        Returns:
+            requests.Response o None: El objeto respuesta si tiene éxito, o None si falla.
+        """
+        try:
+            resp = self.session.post(self.batch_url, data=orjson.dumps({"pages": payloads}), timeout=60)
+            
+            if resp.status_code >= 200 and resp.status_code < 300:
+                logger.info("Ingesta por lotes de %d páginas exitosa. Status: %d", len(payloads), resp.status_code)
+            else:
+                logger.warning("Ingesta por lotes de %d páginas fallida. Status: %d. Respuesta: %s", len(payloads), resp.status_code, resp.text)
+            
+            return resp
+            
+        except RequestException:
+            logger.exception("Error POST a neo_ingest por lotes (red/timeout). Revisar si el servidor está activo.", exc_info=False) 
+            return None
+
+    def replay_file(self, file_path):
+        """
+        Reenvía un volcado NDJSON (un payload de post_page_payload por línea) al endpoint
+        /bulk_ingest. El archivo se sube en streaming, sin cargarlo en memoria.
+
+        Returns:
+            requests.Response o None: El objeto respuesta si tiene éxito, o None si falla.
+        """
+        try:
+            with open(file_path, "rb") as f:
+                resp = self.session.post(self.bulk_url, data=f, headers={"Content-Type": "application/x-ndjson"}, timeout=600)
+            if resp.status_code >= 200 and resp.status_code < 300:
+                logger.info("Volcado %s reproducido. Respuesta: %s", file_path, resp.text)
+            else:
+                logger.warning("Reproducción de %s fallida. Status: %d. Respuesta: %s", file_path, resp.status_code, resp.text)
+            return resp
+        except (OSError, RequestException):
+            logger.exception("Error reproduciendo el volcado %s", file_path, exc_info=False)
+            return None
+
+    def wait_until_ready(self, timeout=30.0, interval=0.2):
+        """
+        Sondea /health hasta que el servidor de ingesta responde 200 o vence `timeout` (s).
+
+        Returns:
+            bool: True si el servidor está listo.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                if self.session.get(self.health_url, timeout=2).status_code == 200:
+                    return True
+            except RequestException:
+                pass
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(interval)
+
+    def close(self):
+        """Cierra la sesión HTTP con el servicio de ingesta."""
+        self.session.close()
+
 # --------------------------------------------------------
 #                   3. EJECUCIÓN PRINCIPAL
 # --------------------------------------------------------
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s [%(name)s] %(message)s")
     # 1. Iniciar el servidor Flask en un hilo separado (Necesario para la prueba)
-    logging.info("Iniciando NeoIngestServer en hilo para la prueba de funcionalidad...")
+    logger.info("Iniciando NeoIngestServer en hilo para la prueba de funcionalidad...")
     server = NeoIngestServer()
     server.start()
     
-    # 2. Dar tiempo al servidor para que inicie (crucial para asegurar que el puerto esté abierto)
-    logging.info("Esperando 3 segundos para que el servidor Flask se inicialice...")
-    time.sleep(3) 
-
-    # 3. Crear el controlador (cliente)
+    # 2. Crear el controlador (cliente)
     neo_controller_instance = NeoController()
+    neo_controller_instance.wait_until_ready()
     
     # --- PRUEBA DE FUNCIONALIDAD (Ejemplo de uso) ---
-    logging.info("Iniciando simulación de uso por TorController...")
+    logger.info("Iniciando simulación de uso por TorController...")
     
     test_payload = {
         "page": {"url": "http://testonion.onion/1", "title": "Test Page Title", "crawl_date": time.time() * 1000},
-        "links": [{"src_url": "http://testonion.onion/1", "dst_url": "http://linkto.onion", "anchor": "test link", "depth": 1, "crawl_date": time.time() * 1000}],
+        "links": [{"dst_url": "http://linkto.onion", "anchor": "test link", "depth": 1, "crawl_date": time.time() * 1000}],
         "matched_terms": [
             {"page_url": "http://testonion.onion/1", "root": "test_root", "synonym": "test_syn1", "source": "title", "crawl_date": time.time() * 1000}
         ]
@@ -90,11 +173,11 @@ if __name__ == '__main__':
     response = neo_controller_instance.post_page_payload(test_payload)
     
     if response and response.status_code == 200:
-        logging.info("Prueba de ingesta exitosa. Neo4j debería tener un nuevo nodo.")
+        logger.info("Prueba de ingesta exitosa. Neo4j debería tener un nuevo nodo.")
     else:
-        logging.error("Prueba de ingesta fallida. Revisa los logs y la conexión a Neo4j.")
+        logger.error("Prueba de ingesta fallida. Revisa los logs y la conexión a Neo4j.")
 
     # Si se ejecuta como script principal, mantenemos el hilo vivo
-    logging.info("Simulación terminada. Servidor sigue en funcionamiento. Presiona Ctrl+C para salir.")
+    logger.info("Simulación terminada. Servidor sigue en funcionamiento. Presiona Ctrl+C para salir.")
     while True:
         time.sleep(1)
\ No newline at end of file
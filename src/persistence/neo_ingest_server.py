@@ -2,10 +2,18 @@
 import os
 import logging
 import threading
+import queue
 import time
+import functools
+import hmac
+import hashlib
+import orjson
 from flask import Flask, request, jsonify, abort
-from neo4j import GraphDatabase, exceptions as neo4j_exceptions
-from urllib.parse import urlparse
+from flask.json.provider import JSONProvider
+from waitress import create_server
+from neo4j import GraphDatabase, RoutingControl, exceptions as neo4j_exceptions
+from urllib.parse import urlsplit
+from collections import OrderedDict
 from datetime import datetime               
 
 # ----------------- CONFIGURACIÓN GLOBAL -----------------
@@ -14,15 +22,177 @@ NEO_URI = "bolt://localhost:7688"
 NEO_USER = os.getenv("NEO_USER", "neo4j")
 NEO_PASS = os.getenv("NEO_PASS", "test1234")
 API_SECRET = os.getenv("NEO_INGEST_SECRET", "changeme") 
+NEO_DATABASE = os.getenv("NEO_DATABASE", "neo4j")
+# Mayor que los hilos WSGI para que ninguna petición espere por una conexión Bolt libre
+NEO_POOL_SIZE = int(os.getenv("NEO_POOL_SIZE", "100"))
+# Espera máxima por una conexión libre del pool y vida máxima de cada conexión (s)
+NEO_ACQUIRE_TIMEOUT = float(os.getenv("NEO_ACQUIRE_TIMEOUT", "30"))
+NEO_CONN_LIFETIME = float(os.getenv("NEO_CONN_LIFETIME", "1200"))
 PORT = int(os.getenv("NEO_INGEST_PORT", "9000"))
+WSGI_THREADS = int(os.getenv("NEO_INGEST_THREADS", "16"))
+# Tamaño máximo del cuerpo de una petición de ingesta (bytes); por encima, 413 sin leerlo
+MAX_BODY_BYTES = int(os.getenv("NEO_INGEST_MAX_BYTES", str(32 * 1024 * 1024)))
+# /bulk_ingest no tiene límite de cuerpo (volcados completos): se acota cada línea NDJSON
+MAX_LINE_BYTES = int(os.getenv("NEO_BULK_MAX_LINE_BYTES", str(8 * 1024 * 1024)))
+# Commit agrupado de /ingest_page: las páginas que llegan a la vez desde distintos hilos WSGI
+# se escriben en una sola transacción (máx. GROUP_COMMIT_MAX; se espera GROUP_COMMIT_WAIT s a más)
+GROUP_COMMIT_MAX = max(1, int(os.getenv("NEO_GROUP_COMMIT_MAX", "200")))
+GROUP_COMMIT_WAIT = float(os.getenv("NEO_GROUP_COMMIT_WAIT", "0.005"))
+# Payloads ya ingestados que se ignoran si se reenvían idénticos (reintentos del cliente):
+# vigencia en segundos (0 = desactivado) y nº máximo de huellas en memoria. La caché es
+# propia de cada proceso: con gunicorn -w N solo evita los reintentos que caen en el mismo
+# worker. Los que llegan a otro no duplican contadores (ver p.last_crawl en CYPHER_PAGES)
+INGEST_DEDUP_TTL = float(os.getenv("NEO_INGEST_DEDUP_TTL", "3600"))
+INGEST_DEDUP_MAX = int(os.getenv("NEO_INGEST_DEDUP_MAX", "100000"))
+# Páginas por transacción al reproducir un volcado NDJSON en /bulk_ingest
+BULK_INGEST_BATCH = max(1, int(os.getenv("NEO_BULK_INGEST_BATCH", "500")))
 
-# Configuración de Logging
-logging.basicConfig(level=logging.INFO, 
-                    format="%(asctime)s %(levelname)s [NEO] %(message)s")
+logger = logging.getLogger(__name__)
 
 # Variables Globales (Compartidas)
 driver = None
 app = Flask(__name__)
+_wsgi_server = None  # instancia creada por create_app() bajo gunicorn
+
+@functools.lru_cache(maxsize=4096)
+def _host_of(url):
+    """Host de una URL (cacheado: muchas páginas comparten el mismo .onion)."""
+    return urlsplit(url).hostname or url
+
+class OrjsonProvider(JSONProvider):
+    """Proveedor JSON de Flask respaldado por orjson (jsonify y request.get_json lo usan)."""
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype="application/json")
+
+app.json = OrjsonProvider(app)
+_API_SECRET_BYTES = API_SECRET.encode("utf-8")
+
+def _check_request(max_bytes=MAX_BODY_BYTES):
+    """
+    Comprobaciones baratas antes de leer y parsear el cuerpo: clave de API en tiempo
+    constante (403) y Content-Length declarado (413; max_bytes=None = sin límite).
+    """
+    key = request.headers.get("X-API-KEY", "").encode("utf-8")
+    if not hmac.compare_digest(key, _API_SECRET_BYTES):
+        abort(403, description="Invalid API key")
+    if max_bytes is not None and request.content_length is not None and request.content_length > max_bytes:
+        abort(413, description="Payload too large")
+
+def _json_body():
+    """Decodifica el cuerpo de la petición con orjson. Devuelve None si no es JSON válido."""
+    # Se lee directamente del stream (sin copia cacheada por Flask) y como mucho MAX_BODY_BYTES:
+    # también acota los cuerpos chunked, que no declaran Content-Length
+    data = request.stream.read(MAX_BODY_BYTES + 1)
+    if len(data) > MAX_BODY_BYTES:
+        abort(413, description="Payload too large")
+    try:
+        return orjson.loads(data)
+    except orjson.JSONDecodeError:
+        return None
+
+def _group_links(links):
+    """
+    Agrupa los enlaces repetidos hacia un mismo destino en una sola fila con su "count"
+    (1 si el cliente no lo envía): un MERGE de LINKS_TO por destino en lugar de uno por aparición.
+    Se conservan los demás campos de la primera aparición.
+    """
+    rows = {}
+    for link in links:
+        n = link.get("count") or 1
+        row = rows.get(link.get("dst_url"))
+        if row is None:
+            rows[link.get("dst_url")] = {**link, "count": n}
+        else:
+            row["count"] += n
+    return list(rows.values())
+
+# Huella del payload -> instante de caducidad (orden de inserción = orden de caducidad).
+# En memoria del proceso: no se comparte entre workers de gunicorn
+_recent_ingests = OrderedDict()
+_recent_lock = threading.Lock()
+
+def _payload_key(payload):
+    """Huella de un payload de página (incluye crawl_date: un nuevo crawl nunca coincide)."""
+    return hashlib.blake2b(orjson.dumps(payload), digest_size=16).digest()
+
+def _already_ingested(key):
+    """True si ese mismo payload se ingestó hace menos de INGEST_DEDUP_TTL segundos."""
+    if INGEST_DEDUP_TTL <= 0:
+        return False
+    with _recent_lock:
+        expires = _recent_ingests.get(key)
+        if expires is None:
+            return False
+        if expires < time.monotonic():
+            del _recent_ingests[key]
+            return False
+        return True
+
+def _remember_ingested(keys):
+    """Registra los payloads recién escritos en Neo4j (solo tras un commit correcto)."""
+    if INGEST_DEDUP_TTL <= 0:
+        return
+    with _recent_lock:
+        expires = time.monotonic() + INGEST_DEDUP_TTL
+        for key in keys:
+            _recent_ingests[key] = expires
+            _recent_ingests.move_to_end(key)
+        while len(_recent_ingests) > INGEST_DEDUP_MAX:
+            _recent_ingests.popitem(last=False)
+
+# ----------------- CONSULTAS CYPHER -----------------
+# Texto constante: se construye una sola vez y Neo4j reutiliza siempre el mismo plan cacheado.
+# Páginas sueltas y lotes usan la misma sentencia (una sola forma de parámetros, un solo plan).
+# Los contadores (LINKS_TO.count, MENTIONS.count) solo suman si el crawl_date de la página es
+# posterior al último ingestado (p.last_crawl): un payload reenviado (reintento del cliente, otro
+# worker, volcado reproducido) no los duplica. crawl_date es ISO en UTC: se compara como texto
+# (sin crawl_date se suma siempre, como antes).
+CYPHER_PAGES = """
+UNWIND $pages AS pg
+MERGE (p:Page {url: pg.url})
+ON CREATE SET p.title = pg.title, p.text = pg.text, 
+              p.host = pg.host, p.has_html_content = true,
+              p.first_seen = coalesce(pg.crawl_date,timestamp())
+ON MATCH SET p.title = CASE WHEN pg.title <> '' THEN pg.title ELSE p.title END,
+             p.text = CASE WHEN pg.text <> '' THEN pg.text ELSE p.text END,
+             p.updated_at = coalesce(pg.crawl_date,timestamp())
+WITH p, pg, (pg.crawl_date IS NULL OR p.last_crawl IS NULL OR pg.crawl_date > p.last_crawl) AS fresh
+SET p.last_crawl = CASE WHEN fresh AND pg.crawl_date IS NOT NULL THEN pg.crawl_date ELSE p.last_crawl END
+WITH p, pg, fresh
+CALL {
+  WITH p, pg, fresh
+  UNWIND pg.links AS r
+  MERGE (b:Page {url: r.dst_url})
+  ON CREATE SET b:Seed, b.first_seen_as_link = coalesce(r.crawl_date, timestamp())
+  MERGE (p)-[rel:LINKS_TO]->(b)
+  ON CREATE SET rel.first_detected = coalesce(r.crawl_date, timestamp()), 
+                rel.count = r.count,
+                rel.depth = r.depth
+  ON MATCH SET rel.count = CASE WHEN fresh THEN coalesce(rel.count, 0) + r.count ELSE rel.count END, 
+               rel.last_detected = coalesce(r.crawl_date, timestamp()),
+               rel.last_anchor = r.anchor
+  RETURN count(*) AS n_links
+}
+CALL {
+  WITH p, pg, fresh
+  UNWIND pg.matched AS r
+  MERGE (t:Term {name: r.root})
+  MERGE (s:Synonym {name: r.synonym})
+  MERGE (s)-[:IS_SYNONYM_OF]->(t)
+  MERGE (p)-[m:MENTIONS {source: r.source, root: r.root}]->(s)
+  ON CREATE SET m.first_seen = coalesce(r.crawl_date, timestamp()), m.count = 1
+  ON MATCH SET m.count = CASE WHEN fresh THEN m.count + 1 ELSE m.count END 
+  RETURN count(*) AS n_terms
+}
+RETURN count(p) AS n_pages
+"""
 
 # --------------------------------------------------------
 #               1. NeoIngestServer (Servidor)
@@ -39,6 +209,9 @@ class NeoIngestServer(threading.Thread):
         self.port = port
         self.daemon = True 
         self._initialize_driver() 
+        # Cola del commit agrupado: (payload, evento de fin, [excepción o None])
+        self._ingest_q = queue.Queue()
+        threading.Thread(target=self._group_commit_loop, name="neo-group-commit", daemon=True).start()
         self._setup_flask_routes()
 
     def _initialize_driver(self):
@@ -49,127 +222,219 @@ class NeoIngestServer(threading.Thread):
 
         for attempt in range(MAX_RETRIES):
             try:
-                driver = GraphDatabase.driver(NEO_URI, auth=(NEO_USER, NEO_PASS), encrypted=False)
+                driver = GraphDatabase.driver(NEO_URI, auth=(NEO_USER, NEO_PASS), encrypted=False,
+                                              max_connection_pool_size=NEO_POOL_SIZE,
+                                              connection_acquisition_timeout=NEO_ACQUIRE_TIMEOUT,
+                                              max_connection_lifetime=NEO_CONN_LIFETIME,
+                                              keep_alive=True)
                 driver.verify_connectivity()
                 
                 # Éxito en la conexión
-                logging.info("Conexión a Neo4j establecida correctamente.")
+                logger.info("Conexión a Neo4j establecida correctamente.")
                 self._ensure_constraints()
                 return 
             
             except neo4j_exceptions.AuthError:
-                logging.error("Error de autenticación: Verifica NEO_USER y NEO_PASS. Falla crítica, abortando.")
+                logger.error("Error de autenticación: Verifica NEO_USER y NEO_PASS. Falla crítica, abortando.")
                 driver = None
                 return 
             
             except neo4j_exceptions.ServiceUnavailable as e:
                 if attempt < MAX_RETRIES - 1:
-                    logging.warning(f"Neo4j no está disponible en {NEO_URI}. Reintentando en {RETRY_DELAY}s... (Intento {attempt + 1}/{MAX_RETRIES})")
+                    logger.warning(f"Neo4j no está disponible en {NEO_URI}. Reintentando en {RETRY_DELAY}s... (Intento {attempt + 1}/{MAX_RETRIES})")
                     time.sleep(RETRY_DELAY)
                 else:
-                    logging.error(f"Neo4j no está disponible después de {MAX_RETRIES} intentos en {NEO_URI}.")
+                    logger.error(f"Neo4j no está disponible después de {MAX_RETRIES} intentos en {NEO_URI}.")
                     driver = None
                     return
             
             except Exception as e:
-                logging.error("Error al inicializar Neo4j driver: %s", e)
+                logger.error("Error al inicializar Neo4j driver: %s", e)
                 driver = None
                 return
 
     def _ensure_constraints(self):
-        """Asegura que los constraints de unicidad existan en Neo4j."""
+        """Asegura que los constraints de unicidad y los índices auxiliares existan en Neo4j."""
         if not driver:
             return
             
         try:
-            with driver.session() as s:
+            with driver.session(database=NEO_DATABASE) as s:
                 s.run("CREATE CONSTRAINT page_url_unique IF NOT EXISTS FOR (p:Page) REQUIRE p.url IS UNIQUE")
                 s.run("CREATE CONSTRAINT term_name_unique IF NOT EXISTS FOR (t:Term) REQUIRE t.name IS UNIQUE")
                 s.run("CREATE CONSTRAINT synonym_name_unique IF NOT EXISTS FOR (s:Synonym) REQUIRE s.name IS UNIQUE")
-            logging.info("Constraints creadas/aseguradas.")
+                s.run("CREATE INDEX page_host_idx IF NOT EXISTS FOR (p:Page) ON (p.host)")
+                s.run("CREATE INDEX mentions_source_root IF NOT EXISTS FOR ()-[m:MENTIONS]-() ON (m.source, m.root)")
+            logger.info("Constraints e índices creados/asegurados.")
         except Exception as e:
-            logging.error("Error al crear constraints: %s", e)
+            logger.error("Error al crear constraints: %s", e)
+
+    @staticmethod
+    def _page_row(payload):
+        """Fila de CYPHER_PAGES para un payload de /ingest_page (enlaces y términos dentro de su página)."""
+        page = payload.get("page", {})
+        url = page.get("url", "")
+        return {
+            "url": url, "host": _host_of(url),
+            "title": page.get("title",""), "text": page.get("text",""),
+            "crawl_date": page.get("crawl_date"),
+            "links": _group_links(payload.get("links", []) or []),
+            "matched": payload.get("matched_terms", []) or []
+        }
+
+    def _upsert_page_and_relations(self, payload, key=None):
+        """Persiste una página con sus enlaces y términos (misma sentencia que los lotes, con una fila)."""
+        self._upsert_batch([payload], None if key is None else [key])
 
-    def _upsert_page_and_relations(self, payload):
-        """Ejecuta las consultas Cypher para persistir la página, enlaces y términos."""
+    def _upsert_batch(self, payloads, keys=None):
+        """
+        Persiste varias páginas (cada una con el formato de /ingest_page) en una sola
+        transacción y una sola sentencia: UNWIND de páginas con sus enlaces y términos.
+        Se omiten los payloads repetidos dentro del lote y los ya ingestados hace poco
+        (keys: sus huellas, si el llamador ya las tiene). Devuelve las URLs escritas.
+        """
         global driver
         if not driver:
             raise Exception("Neo4j driver no está activo. Imposible guardar datos.")
 
-        page = payload.get("page", {})
-        links = payload.get("links", []) or []
-        matched = payload.get("matched_terms", []) or []
-        
-        url = page.get("url", "")
-        host = urlparse(url).hostname or url
-
-        # Insertar/actualizar la página y relaciones
-        with driver.session() as s:
-            # 1. MERGE Page node 
-            s.run("""
-            MERGE (p:Page {url: $url})
-            ON CREATE SET p.title = $title, p.text = $text, 
-                          p.host = $host, p.has_html_content = true,
-                          p.first_seen = coalesce($crawl_date,timestamp())
-            ON MATCH SET p.title = CASE WHEN $title <> '' THEN $title ELSE p.title END,
-                         p.text = CASE WHEN $text <> '' THEN $text ELSE p.text END,
-                         p.updated_at = coalesce($crawl_date,timestamp())
-            """, {
-                "url": url, "host": host, "title": page.get("title",""), "text": page.get("text",""),
-                "crawl_date": page.get("crawl_date")
-            })
-            
-            # 2. UNWIND links -> create LINKS_TO 
-            if links:
-                s.run("""
-                UNWIND $rows AS r
-                MERGE (a:Page {url: r.src_url})
-                MERGE (b:Page {url: r.dst_url})
-                ON CREATE SET b:Seed, b.first_seen_as_link = coalesce(r.crawl_date, timestamp())
-                
-                MERGE (a)-[rel:LINKS_TO]->(b)
-
-                ON CREATE SET rel.first_detected = coalesce(r.crawl_date, timestamp()), 
-                              rel.count = 1,
-                              rel.depth = r.depth
-                            
-                ON MATCH SET rel.count = coalesce(rel.count, 0) + 1, 
-                             rel.last_detected = coalesce(r.crawl_date, timestamp()),
-                             rel.last_anchor = r.anchor
-                """, {"rows": links})
-
-            # 3. UNWIND matched_terms -> CREACIÓN DE TÉRMINOS Y RELACIONES MENTIONS
-            if matched:
-                s.run("""
-                UNWIND $rows AS r
-                MERGE (t:Term {name: r.root})
-                MERGE (s:Synonym {name: r.synonym})
-                MERGE (s)-[:IS_SYNONYM_OF]->(t)
-                MERGE (p:Page {url: r.page_url})
-                MERGE (p)-[m:MENTIONS {source: r.source, root: r.root}]->(s)
-                ON CREATE SET m.first_seen = coalesce(r.crawl_date, timestamp()), m.count = 1
-                ON MATCH SET m.count = m.count + 1 
-                """, {"rows": matched})
+        if keys is None:
+            keys = [_payload_key(payload) for payload in payloads]
+        seen = set()
+        fresh = []
+        for key, payload in zip(keys, payloads):
+            if key in seen or _already_ingested(key):
+                continue
+            seen.add(key)
+            fresh.append(payload)
+        if not fresh:
+            return []
+
+        # Enlaces y términos viajan dentro de su página: el nodo origen ya está ligado
+        # en la consulta y no hace falta volver a buscarlo (ni enviar src_url) por cada fila.
+        pages = [self._page_row(payload) for payload in fresh]
+
+        driver.execute_query(CYPHER_PAGES, {"pages": pages}, database_=NEO_DATABASE, routing_=RoutingControl.WRITE)
+        _remember_ingested(seen)
+        return [p["url"] for p in pages]
+
+    def _upsert_grouped(self, payload, key):
+        """
+        Encola la página (con su huella) para el próximo commit agrupado y espera a que se
+        escriba. La respuesta sigue siendo síncrona: relanza el error si su transacción falla.
+        """
+        item = (payload, key, threading.Event(), [None])
+        self._ingest_q.put(item)
+        item[2].wait()
+        if item[3][0] is not None:
+            raise item[3][0]
+
+    def _group_commit_loop(self):
+        """Hilo de fondo: agrupa las páginas encoladas y las escribe con _upsert_batch."""
+        while True:
+            items = [self._ingest_q.get()]
+            try:
+                while len(items) < GROUP_COMMIT_MAX:
+                    items.append(self._ingest_q.get(timeout=GROUP_COMMIT_WAIT))
+            except queue.Empty:
+                pass
+
+            try:
+                self._upsert_batch([payload for payload, _, _, _ in items], [key for _, key, _, _ in items])
+            except Exception as e:
+                if len(items) == 1:
+                    items[0][3][0] = e
+                else:
+                    # Una página inválida no debe tumbar al resto: se reintentan por separado
+                    logger.warning("Commit agrupado de %d páginas fallido (%s); reintentando una a una", len(items), e)
+                    for payload, key, _, error in items:
+                        try:
+                            self._upsert_page_and_relations(payload, key)
+                        except Exception as page_error:
+                            error[0] = page_error
+            for _, _, done, _ in items:
+                done.set()
 
     def _setup_flask_routes(self):
         """Define las rutas del servidor Flask."""
         
         @app.route("/ingest_page", methods=["POST"])
         def ingest_page():
-            key = request.headers.get("X-API-KEY")
-            if key != API_SECRET:
-                abort(403, description="Invalid API key")
-            payload = request.get_json(silent=True)
-            if not payload or "page" not in payload:
+            _check_request()
+            payload = _json_body()
+            if not isinstance(payload, dict) or "page" not in payload:
                 abort(400, description="Invalid payload")
+            key = _payload_key(payload)
+            if _already_ingested(key):
+                return jsonify({"status":"ok", "ingested_page": payload["page"].get("url",""), "cached": True})
             try:
-                self._upsert_page_and_relations(payload)
+                self._upsert_grouped(payload, key)
             except Exception as e:
-                logging.exception("Neo upsert failed for URL: %s", payload["page"].get("url","")) 
+                logger.exception("Neo upsert failed for URL: %s", payload["page"].get("url","")) 
                 return jsonify({"status":"error", "detail": str(e)}), 500
             
             return jsonify({"status":"ok", "ingested_page": payload["page"].get("url","")})
 
+        @app.route("/ingest_pages", methods=["POST"])
+        def ingest_pages():
+            """Ingesta por lotes: {"pages": [payload, ...]} con payloads como los de /ingest_page."""
+            _check_request()
+            body = _json_body()
+            pages = body.get("pages") if isinstance(body, dict) else None
+            if not isinstance(pages, list) or not all(isinstance(p, dict) and "page" in p for p in pages):
+                abort(400, description="Invalid payload")
+            # Las páginas repetidas en el lote, o de un lote reenviado tras un fallo de red
+            # ya escrito, no se vuelven a escribir (_upsert_batch las omite)
+            try:
+                written = self._upsert_batch(pages)
+            except Exception as e:
+                logger.exception("Neo batch upsert failed (%d pages)", len(pages))
+                return jsonify({"status":"error", "detail": str(e)}), 500
+            
+            return jsonify({"status":"ok", "ingested_pages": [p["page"].get("url","") for p in pages],
+                            "cached": len(pages) - len(written)})
+
+        @app.route("/bulk_ingest", methods=["POST"])
+        def bulk_ingest():
+            """
+            Reproducción de volcados (p.ej. tras una caída de Neo4j): cuerpo NDJSON con un payload
+            de /ingest_page por línea. Se lee en streaming y se escribe en transacciones de
+            BULK_INGEST_BATCH páginas; si falla, devuelve cuántas quedaron ya escritas.
+            El cuerpo no tiene límite de tamaño; cada línea, como mucho MAX_LINE_BYTES.
+            """
+            _check_request(max_bytes=None)
+            batch, done, n = [], 0, 0
+            stream = request.stream
+            try:
+                while True:
+                    line = stream.readline(MAX_LINE_BYTES + 1)
+                    if not line:
+                        break
+                    n += 1
+                    if len(line) > MAX_LINE_BYTES:
+                        return jsonify({"status":"error", "detail": f"Line {n} exceeds {MAX_LINE_BYTES} bytes", "ingested": done}), 413
+                    if not line.strip():
+                        continue
+                    try:
+                        payload = orjson.loads(line)
+                    except orjson.JSONDecodeError:
+                        payload = None
+                    if not isinstance(payload, dict) or "page" not in payload:
+                        return jsonify({"status":"error", "detail": f"Invalid payload at line {n}", "ingested": done}), 400
+                    batch.append(payload)
+                    if len(batch) >= BULK_INGEST_BATCH:
+                        self._upsert_batch(batch)
+                        done += len(batch)
+                        batch = []
+                if batch:
+                    self._upsert_batch(batch)
+                    done += len(batch)
+            except Exception as e:
+                logger.exception("Neo bulk ingest failed after %d pages", done)
+                return jsonify({"status":"error", "detail": str(e), "ingested": done}), 500
+
+            logger.info("Bulk ingest: %d páginas", done)
+            return jsonify({"status":"ok", "ingested": done})
+
         @app.route("/health", methods=["GET"])
         def health():
             """Ruta de chequeo de salud."""
@@ -179,18 +444,32 @@ class NeoIngestServer(threading.Thread):
             return jsonify({"status":"ok"})
 
     def run(self):
-        """Método principal del Thread, inicia el servidor Flask."""
-        logging.info(f"Starting Flask Neo ingest server in background on {self.host}:{self.port}")
+        """Método principal del Thread, sirve la app Flask con waitress (pool de hilos WSGI)."""
+        logger.info(f"Starting Neo ingest server (waitress, {WSGI_THREADS} threads) in background on {self.host}:{self.port}")
         try:
-            app.run(host=self.host, port=self.port, threaded=True, debug=False, use_reloader=False)
+            server = create_server(app, host=self.host, port=self.port, threads=WSGI_THREADS)
+            server.run()
         except Exception as e:
-            logging.error("Failed to start Flask server: %s", e)
+            logger.error("Failed to start WSGI server: %s", e)
+
+def create_app():
+    """
+    Fábrica para servidores WSGI externos (gunicorn). Cada worker inicializa una sola vez
+    su driver de Neo4j (constraints incluidos) y las rutas, sin arrancar el hilo de waitress.
+    """
+    global _wsgi_server
+    if _wsgi_server is None:
+        # Sin efecto si gunicorn ya ha configurado el logging raíz
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s [%(name)s] %(message)s")
+        _wsgi_server = NeoIngestServer()
+    return app
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s [%(name)s] %(message)s")
     # Si se ejecuta este archivo directamente, solo inicia el servidor.
     server = NeoIngestServer()
     server.start()
-    logging.info("NeoIngestServer running. Press Ctrl+C to exit.")
+    logger.info("NeoIngestServer running. Press Ctrl+C to exit.")
     # Mantener el hilo principal vivo
     while True:
         time.sleep(1)
\ No newline at end of file